@@ -23,6 +23,12 @@ setuptools.setup(
     install_requires=[
         "requests",
     ],
+    extras_require={
+        "table": ["numpy"],
+    },
+    entry_points={
+        "console_scripts": ["wiki-data-dump=wiki_data_dump.cli:main"],
+    },
     packages=setuptools.find_packages(include=["wiki_data_dump"]),
     python_requires=">=3.8",
 )
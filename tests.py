@@ -1,10 +1,45 @@
 """wiki-data-dump tests."""
 
-from unittest import TestCase
-from unittest.mock import patch, MagicMock
+# pylint: disable=too-many-lines
+
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import os
 import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Tuple
+from unittest import TestCase, skipIf
+from unittest.mock import patch, MagicMock
 
-from wiki_data_dump import WikiDump
+import requests
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from wiki_data_dump import WikiDump, BlobStore
+from wiki_data_dump.locking import FileLock, lock_path_for
+from wiki_data_dump.mirrors import MirrorType
+from wiki_data_dump.registry import IndexRegistry, WikiCache
+from wiki_data_dump.shard import plan_shards, ShardPlan, ShardRunner
+from wiki_data_dump.watch import DumpWatcher
+import wiki_data_dump.bandwidth
+import wiki_data_dump.cache
+import wiki_data_dump.cli
+import wiki_data_dump.download
+import wiki_data_dump.entities
+import wiki_data_dump.sample
+import wiki_data_dump.schedule
+import wiki_data_dump.sinks
+import wiki_data_dump.trace
 
 
 class IterContentWrapper:
@@ -24,13 +59,68 @@ class IterContentWrapper:
         """Noop for mocking requests.Response.raise_for_status"""
 
 
+class BytesResponse:
+    """Used to mock a streamed requests.Response for a file download."""
+
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+        self.sent = 0
+
+    def iter_content(self, chunk_size: int):
+        """Mocks requests.Response.iter_content"""
+
+        for start in range(0, len(self.content), chunk_size):
+            self.sent += len(self.content[start : start + chunk_size])
+            yield self.content[start : start + chunk_size]
+
+    def close(self):
+        """Noop for mocking requests.Response.close"""
+
+    @staticmethod
+    def raise_for_status():
+        """Noop for mocking requests.Response.raise_for_status"""
+
+
+def base_download_to(destination: str, session, content: bytes, **kwargs):
+    """Starts wiki_data_dump.download.base_download for content without decompression."""
+
+    keywords = {
+        "from_location": "https://example.org/file.sql",
+        "to_location": destination,
+        "size": len(content),
+        "session": session,
+        "sha1": hashlib.sha1(content).hexdigest(),
+        "decompress": False,
+        "download_progress_hook": None,
+        "download_completion_hook": None,
+        "decompress_progress_hook": None,
+        "decompress_completion_hook": None,
+    }
+    keywords.update(kwargs)
+    return wiki_data_dump.download.base_download(**keywords)
+
+
 @patch("requests.Session.get", autospec=True)
 def new_wiki_dump(mock_get: MagicMock) -> WikiDump:
     """Get new WikiDump without caching."""
 
     mock_get.return_value = IterContentWrapper()
     #  Not using cache, and not writing to cache.
-    return WikiDump(use_cache=False, cache_index=False, clear_expired_caches=False)
+    wiki_dump = WikiDump(use_cache=False, cache_index=False, clear_expired_caches=False)
+    _ = wiki_dump.wikis  # Index is loaded lazily, so load it while mocked.
+    return wiki_dump
+
+
+class ScratchDirTestCase(TestCase):
+    """A TestCase with a scratch directory, self.directory, removed after each test."""
+
+    def setUp(self) -> None:
+        """Create a scratch directory."""
+
+        temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
 
 
 class TestWikiDumpWrapper(TestCase):
@@ -179,3 +269,1255 @@ class TestWikiDumpWrapper(TestCase):
 
         #  Only contains 'enwiki' wiki
         self.assertEqual(self.wiki.wikis, ["enwiki"])
+
+
+class TestCoordination(ScratchDirTestCase):
+    """Tests cross-process coordination of the cache and download layers."""
+
+    def test_lock_excludes_second_holder(self):
+        """Tests that a held lock cannot be acquired again until released."""
+
+        path = os.path.join(self.directory, "resource.lock")
+        first, second = FileLock(path), FileLock(path)
+
+        self.assertTrue(first.acquire(blocking=False))
+        self.assertFalse(second.acquire(blocking=False))
+        first.release()
+        self.assertTrue(second.acquire(blocking=False))
+        second.release()
+        self.assertFalse(os.path.exists(path))
+
+    def test_get_cache_does_not_create_empty_file(self):
+        """Tests that a cache miss leaves no file for other processes to misread."""
+
+        result = wiki_data_dump.cache.get_cache(
+            MirrorType.WIKIMEDIA.value, self.directory
+        )
+
+        self.assertIsNone(result.content)
+        self.assertFalse(os.path.exists(result.path))
+
+        wiki_data_dump.cache.write_cache(result.path, "{}")
+        self.assertEqual(
+            wiki_data_dump.cache.get_cache(
+                MirrorType.WIKIMEDIA.value, self.directory
+            ).content,
+            "{}",
+        )
+
+    def test_clear_expired_caches_skips_locked(self):
+        """Tests that an expired cache file in use by another process is kept."""
+
+        path = os.path.join(
+            self.directory, f"wikimedia__20000101{wiki_data_dump.cache.CACHE_EXTENSION}"
+        )
+        wiki_data_dump.cache.write_cache(path, "{}")
+
+        with wiki_data_dump.cache.cache_lock(path):
+            self.assertEqual(
+                wiki_data_dump.cache.clear_expired_caches(self.directory), []
+            )
+        self.assertEqual(
+            wiki_data_dump.cache.clear_expired_caches(self.directory),
+            [os.path.basename(path)],
+        )
+
+    def test_expired_caches_cleared_once_per_dir(self):
+        """Tests that creating many WikiDumps clears a cache dir's expired caches once."""
+
+        with patch("wiki_data_dump.cache.clear_expired_caches") as clear:
+            wiki_data_dump.cache.clear_expired_caches_once(self.directory).join()
+            for _ in range(3):
+                WikiDump(cache_dir=self.directory)
+            self.assertIsNone(
+                wiki_data_dump.cache.clear_expired_caches_once(self.directory)
+            )
+
+        clear.assert_called_once_with(self.directory)
+
+    def test_download_writes_destination(self):
+        """Tests that a download is renamed into place and leaves no partial files."""
+
+        destination = os.path.join(self.directory, "file.sql")
+        session = MagicMock()
+        session.get.return_value = BytesResponse(b"INSERT INTO t VALUES (1);")
+
+        base_download_to(destination, session, b"INSERT INTO t VALUES (1);").join()
+
+        with open(destination, "rb") as f_buffer:
+            self.assertEqual(f_buffer.read(), b"INSERT INTO t VALUES (1);")
+        self.assertEqual(os.listdir(self.directory), ["file.sql"])
+
+    def test_download_reuses_concurrent_fetch(self):
+        """Tests that a download waits for another holder of the destination, then
+        reuses its result instead of fetching again."""
+
+        destination = os.path.join(self.directory, "file.sql")
+        session = MagicMock()
+
+        with FileLock(lock_path_for(destination)):
+            thread = base_download_to(destination, session, b"content")
+            time.sleep(0.2)  # Let the download find the lock held.
+            with open(destination, "wb") as f_buffer:
+                f_buffer.write(b"content")
+        thread.join()
+
+        session.get.assert_not_called()
+
+
+class TestSharding(ScratchDirTestCase):
+    """Tests shard planning and shard claiming over a shared directory."""
+
+    def setUp(self) -> None:
+        """Create WikiDump without caching enabled, and a shared directory."""
+
+        super().setUp()
+        #  pylint: disable=no-value-for-parameter
+        self.wiki = new_wiki_dump()
+        #  pylint: enable=no-value-for-parameter
+
+    def test_plan_covers_every_file_once(self):
+        """Tests that every file is assigned to exactly one shard."""
+
+        plan = plan_shards(self.wiki, n_workers=3)
+        assigned = [key for shard in plan.shards for key in shard.files]
+
+        self.assertEqual(len(plan.shards), 12)
+        self.assertEqual(sorted(assigned), sorted(self.wiki.iter_files()))
+
+    def test_plan_is_deterministic(self):
+        """Tests that planning twice, or through JSON, gives the same plan."""
+
+        plan = plan_shards(self.wiki, n_workers=2)
+
+        self.assertEqual(plan, plan_shards(self.wiki, n_workers=2))
+        self.assertEqual(plan, ShardPlan.from_json(plan.to_json()))
+
+    def test_plan_is_balanced(self):
+        """Tests that no worker gets much more than the largest file above its share."""
+
+        plan = plan_shards(self.wiki, n_workers=2, shards_per_worker=1)
+        sizes = plan.worker_sizes()
+        largest = max(
+            self.wiki.get_file(*key).size or 0 for key in self.wiki.iter_files()
+        )
+
+        self.assertLessEqual(max(sizes) - min(sizes), largest)
+
+    def test_plan_builds_each_wiki_once(self):
+        """Tests that planning builds each wiki once, not once per file."""
+
+        files = list(self.wiki.iter_files())
+        with patch.object(self.wiki, "get_wiki", wraps=self.wiki.get_wiki) as get_wiki:
+            plan_shards(self.wiki, n_workers=2, files=files)
+
+        built = [c.args[0] for c in get_wiki.call_args_list]
+        self.assertEqual(sorted(built), sorted(set(built)))
+
+    def test_waiting_on_destination_lock_heartbeats(self):
+        """Tests that a claim is refreshed while its download waits on another holder of
+        the destination, so the claim does not go stale while waiting."""
+
+        plan = plan_shards(self.wiki, n_workers=1)
+        runner = ShardRunner(
+            self.wiki, plan, self.directory, 0, self.directory, heartbeat_interval=0.0
+        )
+        self.assertTrue(runner.claim(0))
+        claim_path = os.path.join(self.directory, "shard-00000.claim")
+        os.utime(claim_path, (0, 0))
+        destination = os.path.join(self.directory, "file.sql")
+
+        with patch("wiki_data_dump.download.LOCK_WAIT_PROGRESS_INTERVAL", 0.05):
+            with FileLock(lock_path_for(destination)):
+                thread = base_download_to(
+                    destination,
+                    MagicMock(),
+                    b"content",
+                    download_progress_hook=lambda *_: runner.heartbeat(0),
+                )
+                time.sleep(0.2)  # Let the download wait on the lock.
+                self.assertGreater(os.stat(claim_path).st_mtime, 0)
+                with open(destination, "wb") as f_buffer:
+                    f_buffer.write(b"content")
+            thread.join()
+
+    def test_claim_is_exclusive_until_stale(self):
+        """Tests that a live claim blocks other workers, and a stale one is reassigned."""
+
+        plan = plan_shards(self.wiki, n_workers=2)
+        first = ShardRunner(self.wiki, plan, self.directory, 0, self.directory)
+        second = ShardRunner(
+            self.wiki, plan, self.directory, 1, self.directory, stale_after=60.0
+        )
+
+        self.assertTrue(first.claim(0))
+        self.assertFalse(second.claim(0))
+
+        claim_path = os.path.join(self.directory, "shard-00000.claim")
+        os.utime(claim_path, (time.time() - 120, time.time() - 120))
+        self.assertTrue(second.claim(0))
+        self.assertFalse(first.claim(0))
+
+
+class TestBlobStore(ScratchDirTestCase):
+    """Tests the content-addressed store and its use by downloads."""
+
+    def setUp(self) -> None:
+        """Create a scratch directory with a store in it."""
+
+        super().setUp()
+        self.store = BlobStore(os.path.join(self.directory, "store"))
+
+    def test_download_adds_to_store_then_links(self):
+        """Tests that a second download of the same sha1 is linked from the store."""
+
+        content = b"INSERT INTO t VALUES (1);"
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+
+        first = os.path.join(self.directory, "20220401.sql")
+        second = os.path.join(self.directory, "20220420.sql")
+        base_download_to(first, session, content, store=self.store).join()
+        base_download_to(second, session, content, store=self.store).join()
+
+        self.assertEqual(session.get.call_count, 1)
+        self.assertTrue(os.path.samefile(first, second))
+        with open(second, "rb") as f_buffer:
+            self.assertEqual(f_buffer.read(), content)
+
+    def test_collect_garbage_bounds_store(self):
+        """Tests that garbage collection evicts unreferenced blobs first."""
+
+        store = BlobStore(self.store.root, max_bytes=10)
+        sha1s = []
+        for index, content in enumerate((b"0123456789", b"abcdefghij")):
+            path = os.path.join(self.directory, f"{index}.bin")
+            with open(path, "wb") as f_buffer:
+                f_buffer.write(content)
+            sha1s.append(hashlib.sha1(content).hexdigest())
+            store.add(path, sha1s[-1])
+        os.remove(os.path.join(self.directory, "1.bin"))
+
+        self.assertEqual(store.collect_garbage(), [sha1s[1]])
+        self.assertTrue(store.has(sha1s[0]))
+
+
+class TestPageShards(ScratchDirTestCase):
+    """Tests splitting decompressed XML dumps into page-aligned shards."""
+
+    HEADER = b"<mediawiki>\n  <siteinfo>\n    <sitename>Wikipedia</sitename>\n  </siteinfo>\n"
+
+    def test_shards_split_at_pages(self):
+        """Tests that every shard is a complete dump, and shards hold every page once."""
+
+        pages = [
+            f"  <page>\n    <title>{i}</title>\n    <text>{os.urandom(64).hex()}</text>\n"
+            "  </page>\n".encode()
+            for i in range(200)
+        ]
+        document = self.HEADER + b"".join(pages) + b"</mediawiki>\n"
+        content = gzip.compress(document)
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+
+        destination = os.path.join(self.directory, "pages-articles.xml")
+        base_download_to(
+            destination,
+            session,
+            content,
+            from_location="https://example.org/pages-articles.xml.gz",
+            decompress=True,
+            shards=4,
+        ).join()
+
+        manifest_file = os.path.join(self.directory, "pages-articles.shards.json")
+        with open(manifest_file, "r", encoding="utf8") as f_buffer:
+            manifest = json.load(f_buffer)
+        self.assertEqual(manifest["header_bytes"], len(self.HEADER))
+        self.assertGreater(len(manifest["shards"]), 1)
+        self.assertLessEqual(len(manifest["shards"]), 4)
+        self.assertEqual(sum(shard["pages"] for shard in manifest["shards"]), 200)
+        self.assertFalse(os.path.exists(destination))
+
+        bodies = []
+        for shard in manifest["shards"]:
+            with open(os.path.join(self.directory, shard["path"]), "rb") as f_buffer:
+                shard_content = f_buffer.read()
+            self.assertEqual(len(shard_content), shard["bytes"])
+            self.assertTrue(shard_content.startswith(self.HEADER))
+            self.assertTrue(shard_content.endswith(b"</page>\n</mediawiki>\n"))
+            bodies.append(shard_content[len(self.HEADER) : -len(b"</mediawiki>\n")])
+        self.assertEqual(b"".join(bodies), b"".join(pages))
+
+    def test_shards_require_decompressed_xml(self):
+        """Tests that shards are rejected for compressed output, for non-XML files, and
+        for sinks, before anything is requested."""
+
+        session = MagicMock()
+        for from_location, decompress, sink in (
+            ("https://example.org/pages-articles.xml.gz", False, None),
+            ("https://example.org/page.sql.gz", True, None),
+            (
+                "https://example.org/pages-articles.xml.gz",
+                True,
+                wiki_data_dump.sinks.MemorySink(),
+            ),
+        ):
+            with self.assertRaises(AssertionError):
+                base_download_to(
+                    os.path.join(self.directory, "out"),
+                    session,
+                    b"",
+                    from_location=from_location,
+                    decompress=decompress,
+                    shards=4,
+                    sink=sink,
+                )
+        session.get.assert_not_called()
+
+
+class TestEntities(ScratchDirTestCase):
+    """Tests the parallel Wikidata entity reader."""
+
+    ENTITIES = [
+        {
+            "id": f"Q{i}",
+            "type": "item",
+            "labels": {
+                "en": {"language": "en", "value": f"item {i}"},
+                "de": {"language": "de", "value": f"Ding {i}"},
+            },
+            "aliases": {"en": [{"language": "en", "value": f"alias {i}"}]},
+            "claims": {
+                "P31": [{"mainsnak": {"datavalue": {"value": {"id": "Q5"}}}}],
+                "P18": [{"mainsnak": {"datavalue": {"value": f"{i}.jpg"}}}],
+            },
+            "sitelinks": {},
+        }
+        for i in range(50)
+    ]
+
+    def setUp(self) -> None:
+        """Write a gzip entity dump in the dump's array-of-lines layout."""
+
+        super().setUp()
+        self.path = os.path.join(self.directory, "latest-all.json.gz")
+        lines = ",\n".join(json.dumps(entity) for entity in self.ENTITIES)
+        with gzip.open(self.path, "wt", encoding="utf8") as f_buffer:
+            f_buffer.write(f"[\n{lines}\n]\n")
+
+    def test_process_pool_keeps_order(self):
+        """Tests that small batches decoded by a pool come back complete and in order."""
+
+        entities = list(
+            wiki_data_dump.entities.iter_entities(
+                self.path, compact=False, processes=2, batch_bytes=512
+            )
+        )
+
+        self.assertEqual(entities, self.ENTITIES)
+
+    def test_projection(self):
+        """Tests field, property and language projection on a decompression stream."""
+
+        with gzip.open(self.path, "rb") as f_buffer:
+            entities = list(
+                wiki_data_dump.entities.iter_entities(
+                    f_buffer,
+                    fields=["labels", "claims"],
+                    properties=["P31"],
+                    languages=["en"],
+                    processes=0,
+                )
+            )
+
+        self.assertEqual(len(entities), 50)
+        self.assertEqual(
+            entities[3],
+            {"id": "Q3", "labels": {"en": "item 3"}, "claims": {"P31": [{"id": "Q5"}]}},
+        )
+
+
+class TestTracing(ScratchDirTestCase):
+    """Tests the opt-in stage trace and its Chrome trace export."""
+
+    def tearDown(self) -> None:
+        """Stop tracing."""
+
+        wiki_data_dump.trace.disable_tracing()
+
+    def test_spans_are_noops_when_disabled(self):
+        """Tests that spans record nothing unless tracing is enabled."""
+
+        tracer = wiki_data_dump.trace.Tracer()
+        with wiki_data_dump.trace.span("download", "transfer") as span:
+            span.lap("network_seconds")
+        self.assertFalse(span)
+        self.assertEqual(tracer.events, [])
+
+    def test_export_download_stages(self):
+        """Tests that a traced download exports its stages with file and thread context."""
+
+        wiki_data_dump.trace.enable_tracing()
+        content = gzip.compress(b"INSERT INTO t VALUES (1);" * 100)
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+        destination = os.path.join(self.directory, "table.sql")
+        base_download_to(
+            destination,
+            session,
+            content,
+            from_location="https://example.org/table.sql.gz",
+            decompress=True,
+        ).join()
+
+        trace_path = os.path.join(self.directory, "download.trace.json")
+        wiki_data_dump.trace.export_chrome_trace(trace_path)
+        with open(trace_path, "r", encoding="utf8") as f_buffer:
+            events = json.load(f_buffer)["traceEvents"]
+
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+        self.assertEqual(set(spans), {"fetch", "download", "decompress"})
+        self.assertEqual(spans["fetch"]["args"]["file"], destination)
+        for name in ("download", "decompress"):
+            self.assertEqual(
+                spans[name]["args"]["url"], "https://example.org/table.sql.gz"
+            )
+        self.assertEqual(spans["decompress"]["args"]["file"], destination)
+        self.assertEqual(spans["download"]["args"]["bytes"], len(content))
+        for key in ("network_seconds", "sha1_seconds", "write_seconds"):
+            self.assertIn(key, spans["download"]["args"])
+        self.assertEqual(len({event["tid"] for event in spans.values()}), 1)
+        self.assertLessEqual(spans["fetch"]["ts"], spans["download"]["ts"])
+        self.assertIn("thread_name", [event["name"] for event in events])
+
+    def test_sink_download_spans_have_url(self):
+        """Tests that downloads to a sink, which skip the fetch span, trace their url."""
+
+        tracer = wiki_data_dump.trace.enable_tracing()
+        content = b"INSERT INTO t VALUES (1);"
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+
+        base_download_to(
+            None, session, content, sink=wiki_data_dump.sinks.MemorySink()
+        ).join()
+
+        spans = {event["name"]: event for event in tracer.events}
+        self.assertEqual(set(spans), {"download", "decompress"})
+        for span in spans.values():
+            self.assertEqual(span["args"]["url"], "https://example.org/file.sql")
+
+
+class FakeObjectStorage:
+    """An in-memory stand-in for an S3-compatible client's multipart upload methods,
+    which like S3 rejects parts under 5MiB other than the last."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key):  # pylint: disable=invalid-name
+        """Starts an upload."""
+
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = (Bucket, Key, {})
+        return {"UploadId": upload_id}
+
+    def upload_part(
+        self, Bucket, Key, PartNumber, UploadId, Body
+    ):  # pylint: disable=invalid-name,unused-argument
+        """Stores a part, slowly enough for uploads to overlap."""
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        self.uploads[UploadId][2][PartNumber] = Body
+        with self._lock:
+            self.in_flight -= 1
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(
+        self, Bucket, Key, UploadId, MultipartUpload
+    ):  # pylint: disable=invalid-name
+        """Joins the listed parts into an object."""
+
+        parts = self.uploads.pop(UploadId)[2]
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        for number in numbers[:-1]:
+            assert len(parts[number]) >= wiki_data_dump.sinks.MIN_PART_SIZE
+        self.objects[(Bucket, Key)] = b"".join(parts[number] for number in numbers)
+
+    def abort_multipart_upload(
+        self, Bucket, Key, UploadId
+    ):  # pylint: disable=invalid-name,unused-argument
+        """Discards an upload's parts."""
+
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+
+
+class TestSinks(TestCase):
+    """Tests writing downloads to sinks other than local files."""
+
+    def test_multipart_upload_streams_parts(self):
+        """Tests that a decompressed download is uploaded in parallel parts."""
+
+        document = os.urandom(1024 * 1024 * 6).hex().encode()
+        content = gzip.compress(document, compresslevel=1)
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+        storage = FakeObjectStorage()
+        sink = wiki_data_dump.sinks.S3MultipartSink(
+            storage,
+            "dumps",
+            "enwiki/table.sql",
+            part_size=wiki_data_dump.sinks.MIN_PART_SIZE,
+            max_workers=2,
+        )
+
+        base_download_to(
+            None,
+            session,
+            content,
+            from_location="https://example.org/table.sql.gz",
+            decompress=True,
+            sink=sink,
+            chunk_size=1024 * 64,
+        ).join()
+
+        self.assertEqual(storage.objects[("dumps", "enwiki/table.sql")], document)
+        self.assertEqual(storage.uploads, {})
+        self.assertEqual(storage.max_in_flight, 2)
+
+    @patch("threading.excepthook")
+    def test_failed_decompression_aborts_upload(self, _excepthook):
+        """Tests that an upload is aborted, and no object written, if decompression fails."""
+
+        content = b"not gzip" * (1024 * 1024)
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+        storage = FakeObjectStorage()
+        sink = wiki_data_dump.sinks.S3MultipartSink(
+            storage, "dumps", "table.sql", part_size=wiki_data_dump.sinks.MIN_PART_SIZE
+        )
+
+        base_download_to(
+            None,
+            session,
+            content,
+            from_location="https://example.org/table.sql.gz",
+            decompress=True,
+            sink=sink,
+        ).join()
+
+        self.assertEqual(storage.objects, {})
+        self.assertEqual(storage.uploads, {})
+
+    def test_failed_part_stops_upload(self):
+        """Tests that writes raise once a part fails, instead of uploading the rest."""
+
+        storage = FakeObjectStorage()
+        storage.upload_part = MagicMock(side_effect=OSError("part rejected"))
+        sink = wiki_data_dump.sinks.S3MultipartSink(
+            storage,
+            "dumps",
+            "table.sql",
+            part_size=wiki_data_dump.sinks.MIN_PART_SIZE,
+            max_workers=1,
+        )
+
+        with self.assertRaises(OSError):
+            with sink.open() as writer:
+                for _ in range(10):
+                    writer.write(b"x" * wiki_data_dump.sinks.MIN_PART_SIZE)
+
+        self.assertEqual(storage.upload_part.call_count, 1)
+        self.assertEqual(storage.aborted, ["upload-0"])
+
+    def test_memory_sink(self):
+        """Tests that a raw download can be kept in memory."""
+
+        content = b"INSERT INTO t VALUES (1);"
+        session = MagicMock()
+        session.get.return_value = BytesResponse(content)
+        sink = wiki_data_dump.sinks.MemorySink()
+
+        base_download_to(None, session, content, sink=sink).join()
+
+        self.assertEqual(sink.content, content)
+
+
+class TestSampling(TestCase):
+    """Tests reading the first records of a dump without downloading all of it."""
+
+    @staticmethod
+    def multistream_dump(
+        pages: List[bytes], per_stream: int
+    ) -> Tuple[bytes, List[int]]:
+        """Compresses pages as a multistream bz2 dump, returns it with stream offsets."""
+
+        streams = [bz2.compress(b"<mediawiki>\n")]
+        for start in range(0, len(pages), per_stream):
+            streams.append(bz2.compress(b"".join(pages[start : start + per_stream])))
+        offsets = [
+            sum(len(stream) for stream in streams[:i]) for i in range(len(streams))
+        ]
+        return b"".join(streams), offsets
+
+    def test_head_reads_prefix_of_multistream_bz2(self):
+        """Tests that head stops reading once it has n pages, and can start mid-file."""
+
+        pages = [
+            f"  <page>\n    <title>{i}</title>\n    <text>{os.urandom(512).hex()}"
+            "</text>\n  </page>\n".encode()
+            for i in range(1000)
+        ]
+        content, offsets = self.multistream_dump(pages, per_stream=100)
+        response = BytesResponse(content)
+        session = MagicMock()
+        session.get.return_value = response
+        url = "https://example.org/enwiki-pages-articles-multistream.xml.bz2"
+
+        records = wiki_data_dump.sample.head(session, url, 5, chunk_size=1024 * 16)
+
+        self.assertEqual(records, [page.strip() for page in pages[:5]])
+        self.assertLess(response.sent, len(content) / 5)
+        session.get.return_value = BytesResponse(content)
+        self.assertEqual(wiki_data_dump.sample.head(session, url, 0), [])
+
+        response = BytesResponse(content[offsets[3] :], status_code=206)
+        session.get.return_value = response
+        records = wiki_data_dump.sample.head(session, url, 2, offset=offsets[3])
+
+        self.assertEqual(records, [page.strip() for page in pages[200:202]])
+        self.assertEqual(
+            session.get.call_args.kwargs["headers"], {"Range": f"bytes={offsets[3]}-"}
+        )
+
+    def test_head_reads_sql_rows(self):
+        """Tests that rows are split correctly around quoted syntax characters."""
+
+        dump = (
+            b"CREATE TABLE `page` (\n  `page_id` int(8) NOT NULL\n);\n"
+            b"INSERT INTO `page` VALUES (1,0,'A (b);','\\'x\\''),(2,0,'C',NULL),"
+            b"(3,0,'D',NULL);\nINSERT INTO `page` VALUES (4,0,')(',NULL);\n"
+        )
+        session = MagicMock()
+        session.get.return_value = BytesResponse(gzip.compress(dump))
+
+        records = wiki_data_dump.sample.head(
+            session, "https://example.org/page.sql.gz", 4, chunk_size=7
+        )
+
+        self.assertEqual(
+            records,
+            [
+                b"(1,0,'A (b);','\\'x\\'')",
+                b"(2,0,'C',NULL)",
+                b"(3,0,'D',NULL)",
+                b"(4,0,')(',NULL)",
+            ],
+        )
+
+
+class TestBandwidth(TestCase):
+    """Tests the bandwidth governor shared by downloads."""
+
+    def test_token_bucket_serves_in_order(self):
+        """Tests that reservations past the burst wait in the order they were made."""
+
+        bucket = wiki_data_dump.bandwidth.TokenBucket(rate=1000, burst=100)
+
+        self.assertEqual(bucket.reserve(100), 0.0)
+        waits = [bucket.reserve(100) for _ in range(3)]
+
+        self.assertEqual([round(wait, 2) for wait in waits], [0.1, 0.2, 0.3])
+
+    def test_concurrent_downloads_share_cap(self):
+        """Tests that downloads sharing a governor together stay near its rate."""
+
+        content = os.urandom(1024 * 40)
+        governor = wiki_data_dump.bandwidth.BandwidthGovernor(
+            rate=1024 * 200, burst_seconds=0.05, quantum=1024 * 4
+        )
+
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory() as directory:
+            threads = []
+            for i in range(3):
+                session = MagicMock()
+                session.get.return_value = BytesResponse(content)
+                threads.append(
+                    base_download_to(
+                        os.path.join(directory, f"{i}.sql"),
+                        session,
+                        content,
+                        bandwidth=governor,
+                    )
+                )
+            for thread in threads:
+                thread.join()
+        seconds = time.monotonic() - started
+
+        #  120KiB at 200KiB/s, less the 10KiB burst.
+        self.assertGreater(seconds, 0.5)
+        self.assertLess(seconds, 1.5)
+
+    def test_shared_across_governors(self):
+        """Tests that governors sharing a directory share per-mirror limits."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            governors = [
+                wiki_data_dump.bandwidth.BandwidthGovernor(
+                    per_mirror={"example.org": 1000},
+                    burst_seconds=0,
+                    shared_dir=directory,
+                )
+                for _ in range(2)
+            ]
+            url = "https://example.org/file.sql"
+            first = governors[0].reserve(url, 500)
+            second = governors[1].reserve(url, 500)
+            other_mirror = governors[1].reserve("https://other.org/file.sql", 500)
+
+        self.assertAlmostEqual(first, 0.5, places=1)
+        self.assertAlmostEqual(second, 1.0, places=1)
+        self.assertEqual(other_mirror, 0.0)
+
+
+class TestDownloadScheduler(ScratchDirTestCase):
+    """Tests size-ordered, disk-aware download admission."""
+
+    def setUp(self) -> None:
+        """Create a scratch directory, and files of a job."""
+
+        super().setUp()
+        self.files = {
+            name: wiki_data_dump.File(size=size, url=f"/enwiki/20220420/{name}.sql.gz")
+            for name, size in (("a", 30), ("b", 10), ("c", 8), ("d", 5))
+        }
+
+    def test_plan_orders_by_policy(self):
+        """Tests policy order, and that a shared volume needs both file copies."""
+
+        for policy, expected in (
+            ("largest_first", ["a", "b", "c", "d"]),
+            ("shortest_first", ["d", "c", "b", "a"]),
+        ):
+            scheduler = wiki_data_dump.schedule.DownloadScheduler(
+                MagicMock(), self.directory, policy=policy, temp_dir=self.directory
+            )
+            planned = scheduler.plan(self.files.values())
+
+            self.assertEqual(
+                [os.path.basename(item.destination) for item in planned],
+                [f"{name}.sql" for name in expected],
+            )
+        self.assertEqual(list(planned[0].needs.values()), [5 * 5 + 5])
+
+    @patch("wiki_data_dump.schedule.shutil.disk_usage")
+    def test_never_overcommits_disk(self, disk_usage: MagicMock):
+        """Tests that downloads only run together when they fit together, and that a
+        file too large for the volume is rejected."""
+
+        disk_usage.return_value = MagicMock(free=100)
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def download(_file, destination, **_keywords):
+            def fetch():
+                with lock:
+                    overlaps.append(frozenset(running | {destination}))
+                    running.add(destination)
+                time.sleep(0.05)
+                with lock:
+                    running.discard(destination)
+
+            thread = threading.Thread(target=fetch)
+            thread.start()
+            return thread
+
+        wiki_dump = MagicMock()
+        wiki_dump.download.side_effect = download
+        scheduler = wiki_data_dump.schedule.DownloadScheduler(
+            wiki_dump, self.directory, temp_dir=self.directory, margin=0
+        )
+
+        results = scheduler.run(self.files.values())
+
+        errors = {os.path.basename(r.destination): r.error for r in results}
+        self.assertIsInstance(errors.pop("a.sql"), OSError)
+        self.assertEqual(errors, {"b.sql": None, "c.sql": None, "d.sql": None})
+        for overlap in overlaps:
+            #  b and c need 60 + 48 bytes, more than the 100 free.
+            self.assertFalse(
+                {
+                    os.path.join(self.directory, "b.sql"),
+                    os.path.join(self.directory, "c.sql"),
+                }
+                <= overlap
+            )
+        self.assertEqual(wiki_dump.download.call_count, 3)
+
+
+class TestLazyStartup(TestCase):
+    """Tests that construction and import do no unneeded work."""
+
+    @patch("requests.Session.get", autospec=True)
+    def test_construction_defers_index_fetch(self, mock_get: MagicMock):
+        """Tests that the index is fetched on first access, not on construction."""
+
+        mock_get.return_value = IterContentWrapper()
+        wiki_dump = WikiDump(
+            use_cache=False, cache_index=False, clear_expired_caches=False
+        )
+        mock_get.assert_not_called()
+
+        self.assertEqual(wiki_dump.wikis, ["enwiki"])
+        self.assertTrue(wiki_dump.get_wiki("enwiki"))
+        mock_get.assert_called_once()
+
+    def test_import_defers_heavy_modules(self):
+        """Tests that importing the package does not import requests or compression modules."""
+
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-S",  # Site customizations may import these modules themselves.
+                "-c",
+                "import sys, wiki_data_dump; "
+                "print(sorted({'requests', 'bz2', 'gzip'} & set(sys.modules)))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+
+        self.assertEqual(output.strip(), "[]")
+
+
+class TestIndexRegistry(ScratchDirTestCase):
+    """Tests sharing one parsed index between WikiDump instances."""
+
+    def setUp(self) -> None:
+        """Create a cache dir holding today's index, so no request is made."""
+
+        super().setUp()
+        with open("test_data/test_cache.json", "r", encoding="utf8") as f_buffer:
+            content = f_buffer.read()
+        path = wiki_data_dump.cache.get_cache(
+            MirrorType.WIKIMEDIA.value, self.directory
+        ).path
+        wiki_data_dump.cache.write_cache(path, content)
+
+    def new_wiki_dump(self, registry: IndexRegistry) -> WikiDump:
+        """Get a new WikiDump reading the cache dir through registry."""
+
+        return WikiDump(
+            cache_dir=self.directory, clear_expired_caches=False, registry=registry
+        )
+
+    def test_instances_share_index_and_wikis(self):
+        """Tests that instances for the same mirror share the parsed index and Wikis."""
+
+        registry = IndexRegistry()
+        first, second = self.new_wiki_dump(registry), self.new_wiki_dump(registry)
+
+        self.assertIs(
+            first._raw_response_json,  # pylint: disable=protected-access
+            second._raw_response_json,  # pylint: disable=protected-access
+        )
+        self.assertIs(first.get_wiki("enwiki"), second.get_wiki("enwiki"))
+
+    def test_stale_index_is_served_while_refreshing(self):
+        """Tests that an expired entry is returned while it reloads in the background."""
+
+        registry = IndexRegistry(ttl=0.0, stale_while_revalidate=60.0)
+        loads = []
+
+        def loader():
+            loads.append(time.monotonic())
+            return {"wikis": {}}
+
+        stale = registry.get("key", loader)
+        self.assertIs(registry.get("key", loader), stale)
+        for _ in range(100):
+            if len(loads) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(loads), 2)
+
+    def test_wiki_cache_evicts_least_recently_used(self):
+        """Tests that materialized Wikis are bounded by LRU eviction."""
+
+        wikis = WikiCache(max_size=2)
+        wikis["a"], wikis["b"] = 1, 2
+        _ = wikis["a"]
+        wikis["c"] = 3
+
+        self.assertEqual(list(wikis.keys()), ["a", "c"])
+
+
+class FlakyResponse(BytesResponse):
+    """Used to mock a streamed requests.Response whose connection drops after fail_after bytes."""
+
+    def __init__(self, content: bytes, fail_after: int, status_code: int):
+        super().__init__(content)
+        self.fail_after = fail_after
+        self.status_code = status_code
+
+    def iter_content(self, chunk_size: int):
+        """Mocks requests.Response.iter_content, raising a ConnectionError part way."""
+
+        for chunk in super().iter_content(chunk_size):
+            if self.fail_after <= 0:
+                raise requests.ConnectionError("connection reset")
+            self.fail_after -= len(chunk)
+            yield chunk
+
+
+class TestRetries(ScratchDirTestCase):
+    """Tests chunk-level retries and connection pooling."""
+
+    def test_download_resumes_with_range(self):
+        """Tests that a dropped connection is resumed from the last written byte."""
+
+        content = bytes(range(256)) * 8
+        destination = os.path.join(self.directory, "file.sql")
+        session = MagicMock()
+        session.get.side_effect = [
+            FlakyResponse(content, fail_after=1024, status_code=200),
+            FlakyResponse(content[1024:], fail_after=len(content), status_code=206),
+        ]
+        retry = wiki_data_dump.download.RetryPolicy(backoff=0.0)
+
+        base_download_to(destination, session, content, retry=retry).join()
+
+        with open(destination, "rb") as f_buffer:
+            self.assertEqual(f_buffer.read(), content)
+        self.assertEqual(
+            session.get.call_args.kwargs["headers"], {"Range": "bytes=1024-"}
+        )
+
+    def test_requests_time_out_and_failed_streams_close(self):
+        """Tests that requests get the (connect, read) timeout of the retry policy, and
+        that a failed stream is closed before it is retried."""
+
+        content = bytes(range(256)) * 8
+        destination = os.path.join(self.directory, "file.sql")
+        failed = FlakyResponse(content, fail_after=1024, status_code=200)
+        failed.close = MagicMock()
+        session = MagicMock()
+        session.get.side_effect = [
+            failed,
+            FlakyResponse(content[1024:], fail_after=len(content), status_code=206),
+        ]
+        retry = wiki_data_dump.download.RetryPolicy(
+            backoff=0.0, connect_timeout=3.0, read_timeout=7.0
+        )
+
+        base_download_to(destination, session, content, retry=retry).join()
+
+        self.assertEqual(session.get.call_args.kwargs["timeout"], (3.0, 7.0))
+        failed.close.assert_called_once()
+
+    def test_download_gives_up_after_attempts(self):
+        """Tests that a download without progress fails after the retry attempts."""
+
+        destination = os.path.join(self.directory, "file.sql")
+        session = MagicMock()
+        session.get.side_effect = requests.ConnectionError("refused")
+        retry = wiki_data_dump.download.RetryPolicy(attempts=2, backoff=0.0)
+
+        with patch("threading.excepthook") as excepthook:
+            base_download_to(destination, session, b"content", retry=retry).join()
+
+        self.assertIsInstance(
+            excepthook.call_args.args[0].exc_value, requests.ConnectionError
+        )
+        self.assertEqual(session.get.call_count, 3)
+        self.assertFalse(os.path.exists(destination))
+
+    def test_session_pool_is_sized_for_mirror_host(self):
+        """Tests that a created session has a pool_size connection pool for the mirror."""
+
+        wiki_dump = WikiDump(clear_expired_caches=False, pool_size=32)
+        adapter = wiki_dump.session.get_adapter(
+            MirrorType.WIKIMEDIA.value.index_location
+        )
+
+        self.assertEqual(adapter._pool_maxsize, 32)  # pylint: disable=protected-access
+
+
+class StatusResponse:  # pylint: disable=too-few-public-methods
+    """Used to mock a requests.Response for a dumpstatus.json request."""
+
+    def __init__(self, status_code: int, content: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    @staticmethod
+    def raise_for_status():
+        """Noop for mocking requests.Response.raise_for_status"""
+
+
+class TestDumpWatcher(TestCase):
+    """Tests watching jobs through dumpstatus.json."""
+
+    def setUp(self) -> None:
+        """Create WikiDump without caching enabled, with a mocked session."""
+
+        #  pylint: disable=no-value-for-parameter
+        self.wiki = new_wiki_dump()
+        #  pylint: enable=no-value-for-parameter
+        self.wiki.session = MagicMock()
+        self.watcher = DumpWatcher(self.wiki)
+
+    @staticmethod
+    def status(job_status: str, sha1: str = None) -> bytes:
+        """Builds dumpstatus.json content for the xmlstubsdump job."""
+
+        return json.dumps(
+            {
+                "jobs": {
+                    "xmlstubsdump": {
+                        "status": job_status,
+                        "updated": "",
+                        "files": {
+                            "stub.xml.gz": {"size": 1, "url": "/a", "sha1": sha1}
+                        },
+                    }
+                },
+                "version": "0.8",
+            }
+        ).encode()
+
+    def test_status_url_is_next_to_run_files(self):
+        """Tests that the status url is found in the run directory of the wiki."""
+
+        self.assertEqual(
+            self.watcher.status_url("enwiki"),
+            "https://dumps.wikimedia.org/enwiki/20220420/dumpstatus.json",
+        )
+
+    def test_fires_once_when_job_becomes_final(self):
+        """Tests that a callback fires once, when the job is done with sha1 sums."""
+
+        fired = []
+        self.watcher.watch("enwiki", "xmlstubsdump", lambda *args: fired.append(args))
+        self.wiki.session.get.side_effect = [
+            StatusResponse(200, self.status("in-progress"), {"ETag": '"1"'}),
+            StatusResponse(304),
+            StatusResponse(200, self.status("done", "f" * 40), {"ETag": '"2"'}),
+        ]
+
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.watcher.poll(), [("enwiki", "xmlstubsdump")])
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(
+            self.wiki.session.get.call_args_list[1].kwargs["headers"],
+            {"If-None-Match": '"1"'},
+        )
+        self.assertEqual(self.wiki.session.get.call_count, 3)
+
+    def test_watch_added_after_poll_sees_final_job(self):
+        """Tests that a job watched after its wiki was polled fires if already final."""
+
+        def get(_url, headers, **_kwargs):
+            if "If-None-Match" in headers:
+                return StatusResponse(304)
+            return StatusResponse(200, self.status("done", "f" * 40), {"ETag": '"1"'})
+
+        self.wiki.session.get.side_effect = get
+        fired = []
+        self.watcher.watch("enwiki", "pagetable")
+        self.assertEqual(self.watcher.poll(), [])
+
+        self.watcher.watch("enwiki", "xmlstubsdump", lambda *args: fired.append(args))
+
+        self.assertEqual(self.watcher.poll(), [("enwiki", "xmlstubsdump")])
+        self.assertEqual(len(fired), 1)
+
+    def test_downloads_final_job_to_new_directory(self):
+        """Tests that a final job's files are downloaded to a download_dir that did
+        not exist yet."""
+
+        content = b"stub"
+        status = self.status("done", hashlib.sha1(content).hexdigest())
+
+        def get(url, **_kwargs):
+            if url.endswith("dumpstatus.json"):
+                return StatusResponse(200, status)
+            return BytesResponse(content)
+
+        self.wiki.session.get.side_effect = get
+        with tempfile.TemporaryDirectory() as directory:
+            download_dir = os.path.join(directory, "enwiki", "xmlstubsdump")
+            self.watcher.watch("enwiki", "xmlstubsdump", download_dir=download_dir)
+
+            self.assertEqual(self.watcher.poll(), [("enwiki", "xmlstubsdump")])
+            for thread in self.watcher.downloads:
+                thread.join()
+
+            with open(os.path.join(download_dir, "stub.xml.gz"), "rb") as f_buffer:
+                self.assertEqual(f_buffer.read(), content)
+
+
+@skipIf(numpy is None, "FileTable requires numpy")
+class TestFileTable(TestCase):
+    """Tests the columnar file table."""
+
+    def setUp(self) -> None:
+        """Create WikiDump without caching enabled, and its file table."""
+
+        #  pylint: disable=no-value-for-parameter
+        self.wiki = new_wiki_dump()
+        #  pylint: enable=no-value-for-parameter
+        self.table = self.wiki.file_table()
+
+    def test_table_has_row_per_file(self):
+        """Tests that the table has one row for every file from iter_files."""
+
+        self.assertEqual(len(self.table), len(list(self.wiki.iter_files())))
+        self.assertIs(self.table, self.wiki.file_table())
+
+    def test_filtered_total_size(self):
+        """Tests that a filtered total matches summing File sizes one by one."""
+
+        expected = sum(
+            self.wiki.get_file(*key).size
+            for key in self.wiki.iter_files()
+            if self.wiki.get_job(*key[:2]).status == "done" and ".sql" in key[2]
+        )
+        mask = self.table.mask(status="done", name_contains=".sql")
+
+        self.assertEqual(self.table.total_size(mask), expected)
+        self.assertEqual(self.table.total_size(self.table.mask(wiki="[invalid]")), 0)
+
+    def test_sum_by_and_top_k(self):
+        """Tests group-by sums and the largest files."""
+
+        self.assertEqual(self.table.sum_by("wiki"), {"enwiki": self.table.total_size()})
+        self.assertEqual(
+            self.table.top_k(2),
+            [
+                (
+                    "enwiki",
+                    "pagelinkstable",
+                    "enwiki-20220420-pagelinks.sql.gz",
+                    7714037456,
+                ),
+                (
+                    "enwiki",
+                    "externallinkstable",
+                    "enwiki-20220420-externallinks.sql.gz",
+                    5088645712,
+                ),
+            ],
+        )
+
+
+class TestCommandLine(ScratchDirTestCase):
+    """Tests the manifest-driven wiki-data-dump command."""
+
+    def setUp(self) -> None:
+        """Create WikiDump without caching enabled, with a mocked session."""
+
+        super().setUp()
+        #  pylint: disable=no-value-for-parameter
+        self.wiki = new_wiki_dump()
+        #  pylint: enable=no-value-for-parameter
+        self.wiki.session = MagicMock()
+
+    def run_command(self, selectors: list, **kwargs) -> Tuple[int, List[dict]]:
+        """Runs wiki_data_dump.cli.run, returns the exit code and events."""
+
+        out = io.StringIO()
+        code = wiki_data_dump.cli.run(
+            self.wiki,
+            [wiki_data_dump.cli.Selector.from_json(raw) for raw in selectors],
+            self.directory,
+            out=out,
+            **kwargs,
+        )
+        return code, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_dry_run_resolves_selectors(self):
+        """Tests that selectors resolve against the index."""
+
+        code, events = self.run_command(
+            [{"wiki": "en.*", "job": "flagged.*", "files": r"flaggedpages?_"}],
+            dry_run=True,
+        )
+
+        self.assertEqual(code, wiki_data_dump.cli.EXIT_OK)
+        self.assertEqual(events[0]["files"], 2)
+        self.assertEqual(
+            events[1]["destination"],
+            os.path.join(
+                self.directory, "enwiki", "enwiki-20220420-flaggedpage_pending.sql"
+            ),
+        )
+
+    def test_verification_failure_exits_non_zero(self):
+        """Tests that a download that does not match its sha1 sum fails the command."""
+
+        self.wiki.session.get.return_value = BytesResponse(b"not the real file")
+
+        code, events = self.run_command(
+            [{"wiki": "enwiki", "job": "sitestatstable"}], decompress=False
+        )
+
+        self.assertEqual(code, wiki_data_dump.cli.EXIT_VERIFICATION)
+        self.assertIn(
+            {"verification": True, "stage": "download"},
+            [
+                {key: event[key] for key in ("verification", "stage")}
+                for event in events
+                if event["event"] == "failed"
+            ],
+        )
+        self.assertEqual(events[-1]["event"], "summary")
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(
+                    self.directory, "enwiki", "enwiki-20220420-site_stats.sql.gz"
+                )
+            )
+        )
+
+    def test_other_assertion_is_not_verification_failure(self):
+        """Tests that an AssertionError that is not a sha1 mismatch exits as a failure."""
+
+        self.wiki.session.get.return_value = BytesResponse(b"not the real file")
+
+        def failing_hook(*_args):
+            raise AssertionError("unrelated")
+
+        with patch.object(
+            wiki_data_dump.cli._Reporter,  # pylint: disable=protected-access
+            "progress_hook",
+            return_value=failing_hook,
+        ):
+            code, events = self.run_command(
+                [{"wiki": "enwiki", "job": "sitestatstable"}], decompress=False
+            )
+
+        self.assertEqual(code, wiki_data_dump.cli.EXIT_FAILED)
+        failed = [event for event in events if event["event"] == "failed"]
+        self.assertEqual(
+            [(event["error"], event["verification"]) for event in failed],
+            [("unrelated", False)],
+        )
+        self.assertEqual(events[-1]["verification_failed"], 0)
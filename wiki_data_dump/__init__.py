@@ -3,3 +3,4 @@ Wikimedia Data Dumps and their mirrors."""
 
 from wiki_data_dump.core import WikiDump
 from wiki_data_dump.api_response import Wiki, Job, File
+from wiki_data_dump.store import BlobStore
@@ -0,0 +1,7 @@
+"""Runs the wiki-data-dump command with `python -m wiki_data_dump`."""
+
+import sys
+
+from wiki_data_dump.cli import main
+
+sys.exit(main())
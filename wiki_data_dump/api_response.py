@@ -32,6 +32,7 @@ class Job:
         if not self.files:
             return
 
+        self.files = dict(self.files)  # Do not modify the index this Job was built from.
         to_delete = set()
 
         for name, file in self.files.items():
@@ -71,6 +72,7 @@ class Wiki:
     version: str
 
     def __post_init__(self):
+        self.jobs = dict(self.jobs)  # Do not modify the index this Wiki was built from.
         for name, job in self.jobs.items():
             if not isinstance(job, Job):
                 self.jobs[name] = Job(**copy.deepcopy(job))
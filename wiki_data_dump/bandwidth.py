@@ -0,0 +1,149 @@
+"""Holds a bandwidth governor, which keeps the combined transfer rate of every download
+sharing it under a cap, overall and per mirror host, within a process or (through files
+in a shared directory such as the cache dir) across processes."""
+
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional
+
+from wiki_data_dump.locking import FileLock, lock_path_for
+
+STATE_EXTENSION = ".bandwidth"
+
+GLOBAL_KEY = "*"
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """A token bucket of rate bytes per second holding up to burst bytes, kept as the
+    time its reservations are paid off (as in GCRA). Reservations are served in the
+    order they are made, so downloads that reserve one quantum at a time share the rate
+    evenly, and a reservation never waits on one made after it."""
+
+    def __init__(self, rate: float, burst: float):
+        assert rate > 0
+        self.rate = rate
+        self.burst = burst
+        self._paid_until = 0.0
+        self._lock = threading.Lock()
+
+    def _pay(self, paid_until: float, now: float, n: int):
+        """Gets the new paid-off time and the seconds to wait after reserving n bytes."""
+
+        paid_until = max(paid_until, now) + n / self.rate
+        return paid_until, max(paid_until - now - self.burst / self.rate, 0.0)
+
+    def reserve(self, n: int) -> float:
+        """Reserves n bytes, returns the seconds to wait before they are within rate."""
+
+        with self._lock:
+            self._paid_until, wait = self._pay(self._paid_until, time.monotonic(), n)
+        return wait
+
+
+class SharedTokenBucket(TokenBucket):  # pylint: disable=too-few-public-methods
+    """A TokenBucket whose state is kept in a file, so every process using the file
+    shares one rate. Since the state is read and written under a file lock on every
+    reservation, it is meant for reservations of many kilobytes at once."""
+
+    def __init__(self, rate: float, burst: float, path: str):
+        super().__init__(rate, burst)
+        self.path = path
+        self._file_lock = FileLock(lock_path_for(path))
+
+    def reserve(self, n: int) -> float:
+        with self._lock, self._file_lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, "r+", encoding="utf8") as f_buffer:
+                try:
+                    paid_until = float(f_buffer.read() or 0.0)
+                except ValueError:
+                    logging.warning(
+                        f"Resetting unreadable bandwidth state {self.path}."
+                    )
+                    paid_until = 0.0
+                #  Wall time, since monotonic clocks are not comparable across processes.
+                paid_until, wait = self._pay(paid_until, time.time(), n)
+                f_buffer.seek(0)
+                f_buffer.write(repr(paid_until))
+                f_buffer.truncate()
+        return wait
+
+
+class BandwidthGovernor:
+    """Limits downloads to rate bytes per second in total (if rate is given), and to
+    per_mirror[host] bytes per second for each listed mirror host.
+
+    Downloads report received bytes through a limiter (see limiter), and sleep once they
+    are over their share. Buckets allow burst_seconds of their rate to pass at once, so
+    short pauses between chunks do not lose bandwidth. If shared_dir is given (such as a
+    WikiDump's cache dir), limits are shared by every process using that directory."""
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        per_mirror: Optional[Dict[str, float]] = None,
+        burst_seconds: float = 0.25,
+        shared_dir: Optional[str] = None,
+        quantum: int = 1024 * 64,
+    ):
+        self.rate = rate
+        self.per_mirror = dict(per_mirror or {})
+        self.burst_seconds = burst_seconds
+        self.shared_dir = shared_dir
+        self.quantum = quantum
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+        if shared_dir is not None:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def _bucket(self, key: str, rate: float) -> TokenBucket:
+        with self._lock:
+            if key not in self._buckets:
+                burst = rate * self.burst_seconds
+                if self.shared_dir is None:
+                    self._buckets[key] = TokenBucket(rate, burst)
+                else:
+                    name = "global" if key == GLOBAL_KEY else key.replace(":", "_")
+                    path = os.path.join(self.shared_dir, f"{name}{STATE_EXTENSION}")
+                    self._buckets[key] = SharedTokenBucket(rate, burst, path)
+            return self._buckets[key]
+
+    def reserve(self, url: str, n: int) -> float:
+        """Reserves n bytes downloaded from url in every bucket that limits it, returns
+        the seconds to wait before they are within every limit."""
+
+        wait = 0.0
+        if self.rate is not None:
+            wait = self._bucket(GLOBAL_KEY, self.rate).reserve(n)
+        host = urllib.parse.urlsplit(url).netloc
+        if host in self.per_mirror:
+            wait = max(wait, self._bucket(host, self.per_mirror[host]).reserve(n))
+        return wait
+
+    def limiter(self, url: str) -> "Limiter":
+        """Gets a limiter for one download from url."""
+
+        return Limiter(self, url)
+
+
+class Limiter:  # pylint: disable=too-few-public-methods
+    """Counts one download's received bytes, reserving them a quantum at a time, and
+    sleeps when the governor says the download is over its share."""
+
+    def __init__(self, governor: BandwidthGovernor, url: str):
+        self.governor = governor
+        self.url = url
+        self._unreserved = 0
+
+    def __call__(self, n: int) -> None:
+        self._unreserved += n
+        if self._unreserved < self.governor.quantum:
+            return
+        wait = self.governor.reserve(self.url, self._unreserved)
+        self._unreserved = 0
+        if wait > 0:
+            time.sleep(wait)
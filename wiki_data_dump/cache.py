@@ -4,11 +4,13 @@ import os
 import datetime
 import logging
 import re
-from typing import Optional, NamedTuple, List
+import threading
+from typing import Optional, NamedTuple, List, Set, Tuple
 import unicodedata
 
 from wiki_data_dump.mirrors import _Mirror
-
+from wiki_data_dump.locking import FileLock, atomic_open, lock_path_for
+from wiki_data_dump import trace
 
 CACHE_LOCATION = os.path.join(os.path.dirname(__file__), "_caches")
 CACHE_EXTENSION = ".wiki_dump_cache"  # Identifies cache files in the cache dir. This is
@@ -43,10 +45,14 @@ _reserved_characters = {
 _dunder_match = re.compile(r"__+")
 _extension_match = re.compile(rf"{CACHE_EXTENSION}$")
 
+#  (cache dir, day) pairs this process has started clearing, see clear_expired_caches_once.
+_cleared: Set[Tuple[str, str]] = set()
+_cleared_lock = threading.Lock()
+
 
 class CacheResult(NamedTuple):
     """Contains the result of a cache request, with the path created/found and the
-     content if file exists."""
+    content if file exists."""
 
     path: str
     content: Optional[str]
@@ -83,9 +89,12 @@ def _get_today() -> str:
 
 
 def get_cache(mirror: _Mirror, cache_dir: Optional[str]) -> CacheResult:
-    """Gets cached mirror index file, and creates one if none exists.
+    """Gets cached mirror index file, and creates the cache dir if none exists.
     Cached filenames are in the format
-    './_caches/[mirror_name]__[YYYMMDD of creation].wiki_dump_cache'"""
+    './_caches/[mirror_name]__[YYYMMDD of creation].wiki_dump_cache'
+
+    The cache file itself is only created by write_cache, so a missing file is
+    never mistaken for an empty index by another process."""
 
     today = _get_today()
     filename = f"{_normalize_name(mirror.name)}__{today}{CACHE_EXTENSION}"
@@ -99,19 +108,51 @@ def get_cache(mirror: _Mirror, cache_dir: Optional[str]) -> CacheResult:
     #  Make sure mirror name does not move filename out of cache dir.
 
     if os.path.exists(path):
-        with open(path, "r", encoding="utf8") as f_buffer:
+        with trace.span("read cache", "cache", file=path), open(
+            path, "r", encoding="utf8"
+        ) as f_buffer:
             content = f_buffer.read()
         return CacheResult(path, content if content else None)
 
-    if not os.path.exists(CACHE_LOCATION):
-        os.mkdir(CACHE_LOCATION)
-
-    with open(path, "w", encoding="utf8"):
-        pass  # Make file.
+    os.makedirs(cache_dir, exist_ok=True)
 
     return CacheResult(path, content=None)
 
 
+def write_cache(path: str, content: str) -> None:
+    """Atomically writes index content to a cache path found with get_cache."""
+
+    with trace.span("write cache", "cache", file=path), atomic_open(
+        path, "w", encoding="utf8"
+    ) as f_buffer:
+        f_buffer.write(content)
+
+
+def cache_lock(path: str) -> FileLock:
+    """Gets the lock that guards filling or removing the cache file at path. Hold it
+    while fetching an index so only one process sharing cache_dir fetches it."""
+
+    return FileLock(lock_path_for(path))
+
+
+def _remove_unless_locked(path: str) -> bool:
+    """Removes a cache file unless another process holds its lock, returns
+    whether the file was removed."""
+
+    lock = cache_lock(path)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        os.remove(path)
+    except OSError:
+        #  Already removed by another process, or still open on platforms
+        #  that do not allow removing open files.
+        return False
+    finally:
+        lock.release()
+    return True
+
+
 def clear_expired_caches(cache_dir: Optional[str]) -> List[str]:
     """Returns a list of names of cache files that were removed because
     the date created has passed."""
@@ -120,6 +161,9 @@ def clear_expired_caches(cache_dir: Optional[str]) -> List[str]:
 
     cache_dir = cache_dir if cache_dir else CACHE_LOCATION
 
+    if not os.path.isdir(cache_dir):
+        return removed
+
     for name in os.listdir(cache_dir):
         without_extension = _extension_match.sub("", name)
         if without_extension != name:
@@ -131,13 +175,32 @@ def clear_expired_caches(cache_dir: Optional[str]) -> List[str]:
             except (ValueError, AssertionError):
                 #  If invalid date or no name/date, do not delete file.
                 continue
-            if _date != _get_today():
-                os.remove(os.path.join(cache_dir, name))
+            if _date != _get_today() and _remove_unless_locked(
+                os.path.join(cache_dir, name)
+            ):
                 removed.append(name)
     logging.info(f"Removed files in cache: {removed}")
     return removed
 
 
+def clear_expired_caches_once(cache_dir: Optional[str]) -> Optional[threading.Thread]:
+    """Starts clear_expired_caches on a background thread, unless this process already
+    started it for cache_dir today, so creating many WikiDumps lists the directory once.
+    Returns the started thread, if any."""
+
+    key = (os.path.abspath(cache_dir if cache_dir else CACHE_LOCATION), _get_today())
+    with _cleared_lock:
+        if key in _cleared:
+            return None
+        _cleared.add(key)
+
+    thread = threading.Thread(
+        target=clear_expired_caches, args=(cache_dir,), daemon=True
+    )
+    thread.start()
+    return thread
+
+
 def force_clear_caches(cache_dir: Optional[str] = None) -> List[str]:
     """Returns list of names of removed files in cache."""
 
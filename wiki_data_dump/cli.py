@@ -0,0 +1,348 @@
+"""Holds the wiki-data-dump command, which downloads the files selected by a manifest
+and reports progress as JSON lines on stdout.
+
+A manifest is a JSON file such as:
+
+    {
+        "mirror": "WIKIMEDIA",
+        "destination": "dumps",
+        "decompress": true,
+        "selectors": [
+            {"wiki": "enwiki", "job": "pagetable"},
+            {"wiki": "(de|fr)wiki", "job": "xmlstubsdump", "files": "history[0-9]+"}
+        ]
+    }
+
+wiki and job are regular expressions matched against the whole name, files is searched
+for in file names and defaults to every file. Files are saved as
+'[destination]/[wiki name]/[file name]'."""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import IO, Dict, List, NamedTuple, Optional, Sequence
+
+from wiki_data_dump.core import WikiDump
+from wiki_data_dump.mirrors import MirrorType
+import wiki_data_dump.api_response
+import wiki_data_dump.download
+
+EXIT_OK = 0
+EXIT_FAILED = 1  # A download or decompression failed.
+EXIT_USAGE = 2  # Invalid arguments or manifest, as with argparse.
+EXIT_VERIFICATION = 3  # A download did not match its sha1 sum.
+
+
+class Selector(NamedTuple):
+    """Selects files by wiki and job name (full matches) and file name (search)."""
+
+    wiki: re.Pattern
+    job: re.Pattern
+    files: re.Pattern
+
+    @classmethod
+    def from_json(cls, raw: dict) -> "Selector":
+        """Parses a selector from a manifest entry."""
+
+        return cls(
+            wiki=re.compile(raw["wiki"]),
+            job=re.compile(raw.get("job", ".*")),
+            files=re.compile(raw.get("files", "")),
+        )
+
+    def matches(self, wiki_name: str, job_name: str, file_name: str) -> bool:
+        """Whether the selector selects a file."""
+
+        return bool(
+            self.wiki.fullmatch(wiki_name)
+            and self.job.fullmatch(job_name)
+            and self.files.search(file_name)
+        )
+
+
+class Selection(NamedTuple):
+    """A file selected by a manifest, with where to save it."""
+
+    wiki_name: str
+    job_name: str
+    file_name: str
+    file: wiki_data_dump.api_response.File
+    destination: str
+
+
+def resolve(
+    wiki_dump: WikiDump,
+    selectors: Sequence[Selector],
+    destination_dir: str,
+    decompress: bool,
+) -> List[Selection]:
+    """Resolves selectors against the index, each file is selected at most once."""
+
+    selections = []
+    for wiki_name in wiki_dump.wikis:
+        if not any(s.wiki.fullmatch(wiki_name) for s in selectors):
+            continue
+        #  Built once per wiki, since building a Wiki parses every job of it.
+        wiki = wiki_dump.get_wiki(wiki_name, cache=False)
+        for job_name, job in wiki.jobs.items():
+            for file_name, file in (job.files or {}).items():
+                if not any(
+                    s.matches(wiki_name, job_name, file_name) for s in selectors
+                ):
+                    continue
+                selections.append(
+                    Selection(
+                        wiki_name,
+                        job_name,
+                        file_name,
+                        file,
+                        os.path.join(
+                            destination_dir,
+                            wiki_name,
+                            wiki_data_dump.download.automatic_resolve_to_location(
+                                file.url or file_name, decompress
+                            ),
+                        ),
+                    )
+                )
+    return selections
+
+
+class _Reporter:
+    """Writes JSON lines events to out, one whole line at a time across threads."""
+
+    def __init__(self, out: IO[str], progress_interval: float):
+        self.out = out
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._last_progress: Dict[str, float] = {}
+
+    def emit(self, event: str, **fields) -> None:
+        """Writes an event."""
+
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields})
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def progress_hook(
+        self, selection: Selection, stage: str
+    ) -> wiki_data_dump.download.ProgressHookType:
+        """Gets a progress hook that emits at most one event per progress_interval."""
+
+        done = [0]
+        key = f"{selection.destination}:{stage}"
+
+        def hook(delta: int, total: int):
+            done[0] += delta
+            now = time.monotonic()
+            if now - self._last_progress.get(key, 0.0) < self.progress_interval:
+                return
+            self._last_progress[key] = now
+            self.emit(
+                "progress",
+                file=selection.file_name,
+                stage=stage,
+                bytes=done[0],
+                total=total,
+            )
+
+        return hook
+
+
+def _fetch(
+    wiki_dump: WikiDump, selection: Selection, decompress: bool, reporter: _Reporter
+) -> Optional[BaseException]:
+    """Downloads one selection, returns the error that stopped it, if any."""
+
+    errors: List[BaseException] = []
+
+    def completion_hook(stage: str):
+        def hook(_exc_type, exc_val, _exc_tb):
+            if exc_val is not None:
+                errors.append(exc_val)
+                reporter.emit(
+                    "failed",
+                    file=selection.file_name,
+                    stage=stage,
+                    error=str(exc_val) or type(exc_val).__name__,
+                    verification=isinstance(
+                        exc_val, wiki_data_dump.download.VerificationError
+                    ),
+                )
+            return True  # Reported here, so not raised again on the download thread.
+
+        return hook
+
+    started = time.monotonic()
+    reporter.emit("started", file=selection.file_name, size=selection.file.size)
+    os.makedirs(os.path.dirname(os.path.abspath(selection.destination)), exist_ok=True)
+
+    wiki_dump.download(
+        selection.file,
+        selection.destination,
+        decompress=decompress,
+        download_progress_hook=reporter.progress_hook(selection, "download"),
+        download_completion_hook=completion_hook("download"),
+        decompress_progress_hook=reporter.progress_hook(selection, "decompress"),
+        decompress_completion_hook=completion_hook("decompress"),
+    ).join()
+
+    if errors:
+        return errors[0]
+    if not os.path.exists(selection.destination):
+        error = RuntimeError("destination was not written")
+        reporter.emit(
+            "failed",
+            file=selection.file_name,
+            stage="decompress",
+            error=str(error),
+            verification=False,
+        )
+        return error
+
+    reporter.emit(
+        "done",
+        file=selection.file_name,
+        destination=selection.destination,
+        bytes=selection.file.size,
+        seconds=round(time.monotonic() - started, 3),
+    )
+    return None
+
+
+def run(
+    wiki_dump: WikiDump,
+    selectors: Sequence[Selector],
+    destination_dir: str,
+    decompress: bool = True,
+    parallelism: int = 4,
+    out: Optional[IO[str]] = None,
+    progress_interval: float = 5.0,
+    dry_run: bool = False,
+) -> int:
+    """Downloads every selected file with up to parallelism downloads at once,
+    writing events to out (defaults to stdout). Returns the exit code."""
+
+    reporter = _Reporter(sys.stdout if out is None else out, progress_interval)
+    started = time.monotonic()
+
+    selections = resolve(wiki_dump, selectors, destination_dir, decompress)
+    reporter.emit(
+        "resolved",
+        files=len(selections),
+        bytes=sum(s.file.size or 0 for s in selections),
+    )
+    if dry_run:
+        for selection in selections:
+            reporter.emit(
+                "selected",
+                wiki=selection.wiki_name,
+                job=selection.job_name,
+                file=selection.file_name,
+                destination=selection.destination,
+            )
+        return EXIT_OK
+
+    with concurrent.futures.ThreadPoolExecutor(max(parallelism, 1)) as executor:
+        errors = list(
+            executor.map(
+                lambda s: _fetch(wiki_dump, s, decompress, reporter), selections
+            )
+        )
+
+    failed = [error for error in errors if error is not None]
+    verification_failed = [
+        e for e in failed if isinstance(e, wiki_data_dump.download.VerificationError)
+    ]
+    seconds = time.monotonic() - started
+    transferred = sum(
+        s.file.size or 0 for s, error in zip(selections, errors) if error is None
+    )
+    reporter.emit(
+        "summary",
+        files=len(selections),
+        failed=len(failed),
+        verification_failed=len(verification_failed),
+        bytes=transferred,
+        seconds=round(seconds, 3),
+        bytes_per_second=round(transferred / seconds, 1) if seconds else None,
+    )
+
+    if verification_failed:
+        return EXIT_VERIFICATION
+    if failed:
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="wiki-data-dump",
+        description="Download the data dump files selected by a manifest, "
+        "reporting progress as JSON lines on stdout.",
+        epilog=f"Exit codes: {EXIT_OK} success, {EXIT_FAILED} a download failed, "
+        f"{EXIT_USAGE} invalid arguments or manifest, "
+        f"{EXIT_VERIFICATION} a download failed sha1 verification.",
+    )
+    parser.add_argument("manifest", help="path to a JSON manifest, or - for stdin")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=4, help="downloads to run at once"
+    )
+    parser.add_argument("-d", "--destination", help="overrides manifest destination")
+    parser.add_argument(
+        "--mirror",
+        choices=[mirror.name for mirror in MirrorType],
+        help="overrides manifest mirror",
+    )
+    parser.add_argument(
+        "--no-decompress",
+        action="store_true",
+        help="keep files compressed, overrides manifest decompress",
+    )
+    parser.add_argument("--cache-dir", help="where the mirror index is cached")
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5.0,
+        help="seconds between progress events for each file",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only resolve and list selected files"
+    )
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Entry point of the wiki-data-dump command, returns the exit code."""
+
+    parser = _parser()
+    args = parser.parse_args(argv)
+
+    try:
+        if args.manifest == "-":
+            manifest = json.load(sys.stdin)
+        else:
+            with open(args.manifest, "r", encoding="utf8") as f_buffer:
+                manifest = json.load(f_buffer)
+        selectors = [Selector.from_json(raw) for raw in manifest["selectors"]]
+        mirror = MirrorType[args.mirror or manifest.get("mirror", "WIKIMEDIA")]
+    except (OSError, ValueError, KeyError, TypeError, re.error) as exc:
+        parser.error(f"invalid manifest: {exc!r}")
+
+    wiki_dump = WikiDump(mirror=mirror, cache_dir=args.cache_dir, pool_size=args.jobs)
+
+    return run(
+        wiki_dump,
+        selectors,
+        destination_dir=args.destination or manifest.get("destination", "."),
+        decompress=not args.no_decompress and manifest.get("decompress", True),
+        parallelism=args.jobs,
+        progress_interval=args.progress_interval,
+        dry_run=args.dry_run,
+    )
@@ -4,80 +4,152 @@ import copy
 import re
 import threading
 import urllib.parse
-import tempfile
-from typing import Union, Tuple, overload, Dict
+from typing import Union, Tuple, overload, Dict, List, Optional, TYPE_CHECKING
 
 import json
-from requests import Session
 
 from wiki_data_dump.mirrors import _Mirror, MirrorType
 import wiki_data_dump.cache
 import wiki_data_dump.api_response
+import wiki_data_dump.bandwidth
 import wiki_data_dump.download
+import wiki_data_dump.store
+import wiki_data_dump.registry
+import wiki_data_dump.sample
+import wiki_data_dump.trace
+
+if TYPE_CHECKING:
+    from requests import Session
+    from wiki_data_dump.table import FileTable
+    from wiki_data_dump.sinks import Sink
 
 
 ProgressHookType = wiki_data_dump.download.ProgressHookType
 CompletionHookType = wiki_data_dump.download.CompletionHookType
 
 
-def _get_index_contents(mirror: _Mirror, sess: Session) -> str:
+def _get_index_contents(mirror: _Mirror, sess: "Session") -> str:
     """Returns index.json contents from mirror."""
 
-    res = sess.get(mirror.index_location, stream=True, timeout=5.0)
-
-    t_file = tempfile.TemporaryFile()
-
-    res.raise_for_status()
+    with wiki_data_dump.trace.span("index", "index", url=mirror.index_location) as span:
+        res = sess.get(mirror.index_location, stream=True, timeout=5.0)
 
-    chunk_size = 1024
+        res.raise_for_status()
 
-    with t_file:
-        for chunk in res.iter_content(chunk_size):
-            t_file.write(chunk)
-        t_file.seek(0)
-        content = t_file.read().decode()
+        chunk_size = 1024
 
-    return content
+        #  Joined in memory rather than through a temporary file, which would import
+        #  tempfile (and with it shutil and the compression modules) at startup.
+        content = b"".join(res.iter_content(chunk_size))
+        span.set(bytes=len(content))
+        return content.decode()
 
 
-class WikiDump:
+class WikiDump:  # pylint: disable=too-many-instance-attributes
     """Primary class of wiki_data_dump, holds logic for getting items from the index
     of the mirror's site and provides utilities for downloading linked files."""
 
     mirror: _Mirror
-    session: Session
+    session: "Session"
     response_json: dict
     cache_dir: str
     use_cache: bool
     cache_index: bool
+    store: wiki_data_dump.store.BlobStore
+    registry: Optional[wiki_data_dump.registry.IndexRegistry]
+    pool_size: int
+    retry: wiki_data_dump.download.RetryPolicy
+    bandwidth: Optional[wiki_data_dump.bandwidth.BandwidthGovernor]
     _cached_wikis: Dict[str, wiki_data_dump.api_response.Wiki]
+    _index: Optional[dict]
 
     def __init__(
         self,
         mirror: MirrorType = MirrorType.WIKIMEDIA,
-        session: Session = None,
+        session: "Session" = None,
         clear_expired_caches: bool = True,
         cache_dir: str = None,
         use_cache: bool = True,
         cache_index: bool = True,
+        store: wiki_data_dump.store.BlobStore = None,
+        registry: Optional[
+            wiki_data_dump.registry.IndexRegistry
+        ] = wiki_data_dump.registry.DEFAULT_REGISTRY,
+        pool_size: int = 16,
+        retry: wiki_data_dump.download.RetryPolicy = wiki_data_dump.download.RetryPolicy(),
+        bandwidth: wiki_data_dump.bandwidth.BandwidthGovernor = None,
     ):
 
         self._mirror = mirror.value
         self.cache_dir = cache_dir
         self.cache_index = cache_index
         self.use_cache = use_cache
+        self.store = store
+        self.registry = registry
+        self.pool_size = pool_size
+        self.retry = retry
+        self.bandwidth = bandwidth
+        self._session = session
+        self._owns_session = session is None
+        self._session_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._index = None
+        self._cached_wikis = wiki_data_dump.registry.WikiCache()
+        self._file_table: Optional[Tuple[dict, "FileTable"]] = None
+
+        #  The index is loaded on first access, and expired caches are cleared in the
+        #  background (once per cache dir and day), so construction never blocks on the
+        #  network or the cache dir.
+        if clear_expired_caches:
+            wiki_data_dump.cache.clear_expired_caches_once(cache_dir)
 
-        if session is None:
-            session = Session()
-            session.headers["User-Agent"] = (
-                "wiki_data_dump/0.0.4 (https://github.com/jon-edward/wiki_dump)"
-            )
-        self.session = session
+    @property
+    def session(self) -> "Session":
+        """The requests Session used for all requests, created on first use.
+
+        A created Session keeps alive a pool of pool_size connections to the mirror's
+        host, so concurrent downloads reuse connections instead of opening new ones."""
+
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    @session.setter
+    def session(self, other: "Session"):
+        with self._session_lock:
+            self._session = other
+            self._owns_session = False
+
+    def _new_session(self) -> "Session":
+        """Creates a Session with a connection pool for the current mirror's host."""
+
+        # pylint: disable=import-outside-toplevel
+        #  Imported here since requests is slow to import, and unneeded for
+        #  lookups served from the cache.
+        from requests import Session
+
+        # pylint: enable=import-outside-toplevel
+        session = Session()
+        session.headers["User-Agent"] = (
+            "wiki_data_dump/0.0.4 (https://github.com/jon-edward/wiki_dump)"
+        )
+        self._mount_pool(session)
+        return session
 
-        self._update_response()
+    def _mount_pool(self, session: "Session") -> None:
+        """Mounts an adapter sized to pool_size for the current mirror's host."""
 
-        if clear_expired_caches:
-            wiki_data_dump.cache.clear_expired_caches(cache_dir)
+        # pylint: disable=import-outside-toplevel
+        from requests.adapters import HTTPAdapter
+
+        # pylint: enable=import-outside-toplevel
+        parts = urllib.parse.urlsplit(self.mirror.index_location)
+        session.mount(
+            f"{parts.scheme}://{parts.netloc}/",
+            HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size),
+        )
 
     @property
     def mirror(self):
@@ -87,33 +159,71 @@ class WikiDump:
 
     @mirror.setter
     def mirror(self, other: MirrorType):
-        """Changes mirror enum, and handles response update."""
+        """Changes mirror enum, the new mirror's index is loaded on next access."""
+
+        with self._index_lock:
+            self._mirror = other.value
+            self._index = None
+            self._cached_wikis = wiki_data_dump.registry.WikiCache()
+        with self._session_lock:
+            if self._owns_session and self._session is not None:
+                self._mount_pool(self._session)
+
+    def _index_state(
+        self,
+    ) -> Tuple[dict, Dict[str, wiki_data_dump.api_response.Wiki]]:
+        """Gets the parsed index and the cache of Wikis built from it. When caching with
+        a registry, both are shared with every WikiDump for the same mirror and cache dir,
+        otherwise the index is loaded on first access and kept by this instance."""
+
+        if self.use_cache and self.registry is not None:
+            entry = self.registry.get(
+                (self.mirror.index_location, self.cache_dir), self._read_index
+            )
+            return entry.index, entry.wikis
+
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._cached_wikis = wiki_data_dump.registry.WikiCache()
+                    self._index = self._read_index()
+        return self._index, self._cached_wikis
+
+    @property
+    def _raw_response_json(self) -> dict:
+        """The parsed index, loaded on first access."""
 
-        self._mirror = other.value
-        self._update_response()
+        return self._index_state()[0]
 
-    def _update_response(self) -> None:
+    def _read_index(self) -> dict:
         """Used internally for getting cached json response contents,
         and caching new index files as needed."""
 
-        self._cached_wikis = {}
-
         if not self.use_cache:
             content = _get_index_contents(self.mirror, self.session)
-            self._raw_response_json = json.loads(content)
-            return
+            with wiki_data_dump.trace.span(
+                "parse index", "index", characters=len(content)
+            ):
+                return json.loads(content)
 
         _cache = wiki_data_dump.cache.get_cache(self.mirror, self.cache_dir)
 
         if _cache.content:
             content = _cache.content
         else:
-            content = _get_index_contents(self.mirror, self.session)
-            if self.cache_index:
-                with open(_cache.path, "w", encoding="utf8") as f_buffer:
-                    f_buffer.write(content)
-
-        self._raw_response_json: dict = json.loads(content)
+            with wiki_data_dump.cache.cache_lock(_cache.path):
+                #  Another process sharing cache_dir may have filled the cache
+                #  while this one waited for the lock.
+                _cache = wiki_data_dump.cache.get_cache(self.mirror, self.cache_dir)
+                if _cache.content:
+                    content = _cache.content
+                else:
+                    content = _get_index_contents(self.mirror, self.session)
+                    if self.cache_index:
+                        wiki_data_dump.cache.write_cache(_cache.path, content)
+
+        with wiki_data_dump.trace.span("parse index", "index", characters=len(content)):
+            return json.loads(content)
 
     @property
     def response_json(self) -> dict:
@@ -162,16 +272,15 @@ class WikiDump:
     ) -> wiki_data_dump.api_response.Wiki:
         """Get Wiki instance associated with wiki_name. Optionally caches result."""
 
+        index, cached_wikis = self._index_state()
+
         try:
-            return self._cached_wikis[wiki_name]
+            return cached_wikis[wiki_name]
         except KeyError:
-            result = wiki_data_dump.api_response.Wiki(
-                **self._raw_response_json["wikis"][wiki_name]
-            )
-            if not cache:
-                return result
-            self._cached_wikis[wiki_name] = result
-        return self._cached_wikis[wiki_name]
+            result = wiki_data_dump.api_response.Wiki(**index["wikis"][wiki_name])
+            if cache:
+                cached_wikis[wiki_name] = result
+        return result
 
     def get_job(
         self, wiki_name: str, job_name: str, *, cache: bool = True
@@ -214,12 +323,29 @@ class WikiDump:
         download_completion_hook: CompletionHookType = None,
         decompress_progress_hook: ProgressHookType = None,
         decompress_completion_hook: CompletionHookType = None,
+        shards: int = None,
+        sink: "Sink" = None,
+        temp_dir: str = None,
     ) -> threading.Thread:
         """Downloads a File with an optional supplied destination - if
         no destination is supplied then it will be assigned based on the
         end component of the originating url. Also includes decompression
         based on file suffix, which can be turned off with decompress.
 
+        If shards is given, decompressed XML is split into that many files of about
+        equal size, cut at </page> boundaries, with a manifest of the shards written
+        next to them (see wiki_data_dump.page_shards).
+
+        If sink is given (see wiki_data_dump.sinks), output is written to it instead
+        of destination, such as straight to object storage with an S3MultipartSink.
+
+        If the WikiDump has a store, files already in it by sha1 are linked to the
+        destination (or decompressed from the store) instead of downloaded. If it has a
+        bandwidth governor, the transfer shares its limits with every other download.
+
+        The compressed file is kept in a temporary file in temp_dir (or the default
+        temporary directory) until it is decompressed.
+
         Returns the Thread instance that the download is running on."""
 
         return wiki_data_dump.download.base_download(
@@ -233,8 +359,52 @@ class WikiDump:
             download_completion_hook=download_completion_hook,
             decompress_progress_hook=decompress_progress_hook,
             decompress_completion_hook=decompress_completion_hook,
+            store=self.store,
+            retry=self.retry,
+            shards=shards,
+            sink=sink,
+            bandwidth=self.bandwidth,
+            temp_dir=temp_dir,
         )
 
+    def head(
+        self,
+        file: wiki_data_dump.api_response.File,
+        n: int = 10,
+        record: str = None,
+        offset: int = 0,
+        max_bytes: int = None,
+    ) -> List[bytes]:
+        """Gets the first n records (XML pages, SQL rows or lines) of a File, reading
+        and decompressing only as much of it as needed. See wiki_data_dump.sample.head
+        for record, offset and max_bytes."""
+
+        return wiki_data_dump.sample.head(
+            self.session,
+            urllib.parse.urljoin(self.mirror.index_location, file.url),
+            n,
+            record=record,
+            offset=offset,
+            max_bytes=max_bytes,
+        )
+
+    def file_table(self) -> "FileTable":
+        """Get a columnar FileTable of every file in the index, for vectorized filtering
+        and size aggregation. Built once per loaded index, and requires numpy."""
+
+        # pylint: disable=import-outside-toplevel
+        #  Imported here since numpy is an optional dependency.
+        from wiki_data_dump.table import FileTable
+
+        # pylint: enable=import-outside-toplevel
+
+        index = self._raw_response_json
+        cached = self._file_table
+        if cached is None or cached[0] is not index:
+            cached = (index, FileTable.from_index(index))
+            self._file_table = cached
+        return cached[1]
+
     def iter_files(self) -> Tuple[str, str, str]:
         """Returns an iterator that contains the file path components
         (wiki_name, job_name, file_name) for every file
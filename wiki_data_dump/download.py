@@ -1,25 +1,107 @@
 """Holds logic for downloading data dump files, with hooks for download progress and completion."""
 
-import bz2
 import functools
-import gzip
 import hashlib
 import io
+import logging
+import os
+import random
 import re
-from tempfile import NamedTemporaryFile
 import threading
+import time
 from types import TracebackType
-from typing import Optional, Callable
+from typing import Optional, Callable, IO, NamedTuple, Tuple, TYPE_CHECKING
 
-import requests
+from wiki_data_dump.locking import FileLock, lock_path_for
+from wiki_data_dump.store import BlobStore
+from wiki_data_dump.page_shards import PageShardWriter, manifest_path
+from wiki_data_dump.sinks import Sink, LocalFileSink
+from wiki_data_dump.bandwidth import BandwidthGovernor
+from wiki_data_dump import trace
+
+if TYPE_CHECKING:
+    import requests
 
 
 ProgressHookType = Callable[[int, int], None]
+
+#  Seconds between zero-byte progress reports while waiting on another holder's lock.
+LOCK_WAIT_PROGRESS_INTERVAL = 5.0
 CompletionHookType = Callable[
     [Optional[type], Optional[Exception], Optional[TracebackType]], None
 ]
 
 
+class VerificationError(AssertionError):
+    """Raised when a download does not match its sha1 sum. A subclass of AssertionError,
+    which verification raised before, but raised even when asserts are disabled."""
+
+
+class RetryPolicy(NamedTuple):
+    """How failed requests are retried: up to attempts times in a row without progress,
+    waiting an exponentially growing delay (capped at max_backoff seconds) with full
+    jitter, so many threads recovering from the same hiccup do not retry in lockstep.
+
+    Requests time out after connect_timeout seconds without connecting, or read_timeout
+    seconds without receiving data, so a stalled connection is retried too."""
+
+    attempts: int = 5
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """The (connect, read) timeout passed to requests."""
+
+        return self.connect_timeout, self.read_timeout
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number attempt (starting at 0)."""
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Whether a request exception is likely transient."""
+
+    # pylint: disable=import-outside-toplevel
+    import requests
+
+    # pylint: enable=import-outside-toplevel
+
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else None
+        return status == 429 or (status is not None and status >= 500)
+    return isinstance(
+        exc,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def _open_response(
+    session: "requests.Session",
+    from_location: str,
+    offset: int,
+    timeout: Optional[Tuple[float, float]] = None,
+) -> "requests.Response":
+    """Requests from_location, starting at byte offset if it is not 0."""
+
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    response = session.get(from_location, stream=True, headers=headers, timeout=timeout)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return response
+
+
 class _FileWrapper(io.IOBase):
     """Wraps a file for tracking how much of the file has been accessed.
     Used for tracking decompression."""
@@ -28,6 +110,7 @@ class _FileWrapper(io.IOBase):
         super().__init__()
         self.source: io.IOBase = source
         self.delta = 0
+        self.position = 0
 
     def read(self, n_characters: int = None):
         """Mirrors io.IOBase.read for readable files."""
@@ -36,6 +119,7 @@ class _FileWrapper(io.IOBase):
         else:
             _content = self.source.read()
         self.delta = len(_content)
+        self.position += self.delta
         return _content
 
 
@@ -61,11 +145,24 @@ def _decompress(
     progress_hook: ProgressHookType,
     completion_hook: CompletionHookType,
     size: int,
+    shards: Optional[int] = None,
+    sink: Optional[Sink] = None,
+    url: Optional[str] = None,
 ):
-    """Decompresses file contained in a _FileWrapper."""
+    """Decompresses file contained in a _FileWrapper to sink (or to_file_path). If shards
+    is given, output is split into that many page-aligned shards with a PageShardWriter.
+    url is the file's source, recorded in the trace.
+    """
 
     assert compression_type in ("bz2", "gz", None)
 
+    # pylint: disable=import-outside-toplevel
+    #  Imported here since compression modules are only needed once a download finishes.
+    import bz2
+    import gzip
+
+    # pylint: enable=import-outside-toplevel
+
     transfer_chunk_size = 1024 * 10
 
     transfer_wrapper: io.IOBase = {
@@ -74,41 +171,116 @@ def _decompress(
         None: lambda: from_file_wrapper,
     }[compression_type]()
 
-    with transfer_wrapper, open(to_file_path, "wb") as to_file_obj, _CompletionManager(
-        completion_hook
-    ):
-        while content := transfer_wrapper.read(transfer_chunk_size):
-            to_file_obj.write(content)
-            progress_hook(from_file_wrapper.delta, size)
+    if shards:
+        output = PageShardWriter(to_file_path, shards)
+    else:
+        output = (sink or LocalFileSink(to_file_path)).open()
+
+    with _CompletionManager(completion_hook), transfer_wrapper, output as to_file_obj:
+        with trace.span(
+            "decompress",
+            "decompress",
+            url=url,
+            file=to_file_path if sink is None else None,
+            compression=compression_type,
+            shards=shards,
+        ) as span:
+            while content := transfer_wrapper.read(transfer_chunk_size):
+                span.lap("read_decompress_seconds")
+                to_file_obj.write(content)
+                if shards:
+                    to_file_obj.observe(from_file_wrapper.position, size)
+                span.lap("write_seconds")
+                progress_hook(from_file_wrapper.delta, size)
+                span.lap("hook_seconds")
 
 
 def _download(
-    response: requests.Response,
-    intermediate_buffer: NamedTemporaryFile,
+    open_response: Callable[[int], "requests.Response"],
+    intermediate_buffer: IO[bytes],
     chunk_size: int,
     size: int,
     progress_hook: ProgressHookType,
     completion_hook: CompletionHookType,
     sha1: str,
-):
-    """Download file from response and verify sha1 sum if available."""
+    retry: RetryPolicy = RetryPolicy(),
+    throttle: Optional[Callable[[int], None]] = None,
+    url: Optional[str] = None,
+) -> bool:
+    """Download file from responses opened at a byte offset by open_response,
+    and verify sha1 sum if available. Returns whether the download completed, which
+    is False if the completion hook suppressed an error.
+
+    Transient errors are retried by retry, resuming from the last byte written with a
+    range request, so an interrupted transfer only costs the retry delay. If throttle
+    is given, it is called with the size of each chunk, and may sleep to limit the rate.
+    url is the file's source, recorded in the trace.
+    """
 
     hex_d = hashlib.sha1()
-
-    with _CompletionManager(completion_hook):
-        for chunk in response.iter_content(chunk_size=chunk_size):
-            progress_hook(intermediate_buffer.write(chunk), size)
-            hex_d.update(chunk)
-
-    if sha1:
-        assert sha1 == hex_d.hexdigest(), "Download verification failed."
+    written = 0
+    attempt = 0
+    retries = 0
+    completed = False
+
+    with _CompletionManager(completion_hook), trace.span(
+        "download", "transfer", url=url, size=size
+    ) as span:
+        while True:
+            resumed_at = written
+            response = None
+            try:
+                span.lap()
+                response = open_response(written)
+                span.lap("connect_seconds")
+                if written and getattr(response, "status_code", 206) != 206:
+                    #  Range was ignored, so the response starts from the beginning.
+                    logging.info("Server ignored range request, restarting download.")
+                    intermediate_buffer.seek(0)
+                    intermediate_buffer.truncate()
+                    hex_d = hashlib.sha1()
+                    written = 0
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    span.lap("network_seconds")
+                    written += intermediate_buffer.write(chunk)
+                    span.lap("write_seconds")
+                    hex_d.update(chunk)
+                    span.lap("sha1_seconds")
+                    progress_hook(len(chunk), size)
+                    span.lap("hook_seconds")
+                    if throttle is not None:
+                        throttle(len(chunk))
+                        span.lap("throttle_seconds")
+                break
+            except Exception as exc:  # pylint: disable=broad-except
+                if response is not None:
+                    #  Return the aborted stream's connection instead of leaving it open.
+                    response.close()
+                if written > resumed_at:
+                    attempt = 0  # Progress was made, so this is a new hiccup.
+                if not _is_retryable(exc) or attempt >= retry.attempts:
+                    raise
+                delay = retry.delay(attempt)
+                logging.warning(f"Retrying at byte {written} in {delay:.2f}s: {exc}")
+                time.sleep(delay)
+                attempt += 1
+                retries += 1
+                span.set(retries=retries)
+
+        #  Verified within the completion hook, so the hook is told of failures.
+        if sha1 and sha1 != hex_d.hexdigest():
+            raise VerificationError("Download verification failed.")
+        span.set(bytes=written)
+        completed = True
+
+    return completed
 
 
 def _download_and_decompress(
     from_location: str,
     to_location: str,
     size: int,
-    session: requests.Session,
+    session: "requests.Session",
     sha1: str,
     compression_type: str,
     download_progress_hook: ProgressHookType,
@@ -116,22 +288,75 @@ def _download_and_decompress(
     decompress_progress_hook: ProgressHookType,
     decompress_completion_hook: CompletionHookType,
     chunk_size: int = 1024,
+    store: Optional[BlobStore] = None,
+    retry: RetryPolicy = RetryPolicy(),
+    shards: Optional[int] = None,
+    sink: Optional[Sink] = None,
+    bandwidth: Optional[BandwidthGovernor] = None,
+    temp_dir: Optional[str] = None,
 ):
-    """Downloads file from source, then decompresses it by the protocol provided."""
+    """Downloads file from source to a temporary file in temp_dir (or the default
+    temporary directory), then decompresses it by the protocol provided.
+    If a store is given, files already in it are used instead of downloading, and
+    verified downloads are added to it."""
+
+    if store is not None and store.has(sha1):
+        with _CompletionManager(download_completion_hook):
+            download_progress_hook(size, size)
+        return _decompress_from_store(
+            store,
+            sha1,
+            to_location,
+            compression_type,
+            decompress_progress_hook,
+            decompress_completion_hook,
+            size,
+            shards,
+            sink,
+            from_location,
+        )
 
-    response = session.get(from_location, stream=True)
-    response.raise_for_status()
+    # pylint: disable=import-outside-toplevel
+    #  Imported here since tempfile imports shutil, and with it the compression modules.
+    from tempfile import NamedTemporaryFile
 
-    with NamedTemporaryFile() as intermediate_buffer:
-        _download(
-            response,
+    # pylint: enable=import-outside-toplevel
+
+    with NamedTemporaryFile(dir=temp_dir) as intermediate_buffer:
+        if not _download(
+            functools.partial(
+                _open_response, session, from_location, timeout=retry.timeout
+            ),
             intermediate_buffer,
             chunk_size,
             size,
             download_progress_hook,
             download_completion_hook,
             sha1,
-        )
+            retry,
+            bandwidth.limiter(from_location) if bandwidth is not None else None,
+            from_location,
+        ):
+            return None  # Failed, the error was handled by the completion hook.
+
+        intermediate_buffer.flush()
+
+        if store is not None and sha1:
+            store.add(intermediate_buffer.name, sha1)
+            store.collect_garbage()
+            if store.has(sha1):
+                return _decompress_from_store(
+                    store,
+                    sha1,
+                    to_location,
+                    compression_type,
+                    decompress_progress_hook,
+                    decompress_completion_hook,
+                    size,
+                    shards,
+                    sink,
+                    from_location,
+                )
 
         intermediate_buffer.seek(0)
 
@@ -144,10 +369,98 @@ def _download_and_decompress(
             decompress_progress_hook,
             decompress_completion_hook,
             size,
+            shards,
+            sink,
+            from_location,
         )
 
 
-def _automatic_resolve_to_location(_from_location: str, _will_decompress: bool) -> str:
+def _decompress_from_store(
+    store: BlobStore,
+    sha1: str,
+    to_location: str,
+    compression_type: Optional[str],
+    progress_hook: ProgressHookType,
+    completion_hook: CompletionHookType,
+    size: int,
+    shards: Optional[int] = None,
+    sink: Optional[Sink] = None,
+    url: Optional[str] = None,
+):
+    """Links a stored file to its destination, or decompresses from the stored file."""
+
+    if compression_type is None and not shards and sink is None:
+        with _CompletionManager(completion_hook), trace.span(
+            "materialize", "store", url=url, file=to_location, sha1=sha1
+        ):
+            store.materialize(sha1, to_location)
+            progress_hook(size, size)
+        return None
+
+    with open(store.path_for(sha1), "rb") as blob:
+        return _decompress(
+            _FileWrapper(blob),
+            to_location,
+            compression_type,
+            progress_hook,
+            completion_hook,
+            size,
+            shards,
+            sink,
+            url,
+        )
+
+
+def _download_once(
+    to_location: str,
+    download_completion_hook: CompletionHookType,
+    decompress_completion_hook: CompletionHookType,
+    shards: Optional[int] = None,
+    **keywords,
+):
+    """Runs _download_and_decompress while holding the destination's lock, so exactly one
+    process or thread fetches a destination. Callers that find the lock held wait for the
+    holder, then reuse its result if the destination was written. While waiting, they
+    report zero bytes of download progress every LOCK_WAIT_PROGRESS_INTERVAL seconds, so
+    progress hooks used as heartbeats see the download is still alive."""
+
+    lock = FileLock(lock_path_for(to_location))
+
+    with trace.span(
+        "fetch", "fetch", file=to_location, url=keywords.get("from_location")
+    ) as span:
+        if lock.acquire(blocking=False):
+            reuse = False
+        else:
+            while not lock.acquire(timeout=LOCK_WAIT_PROGRESS_INTERVAL):
+                keywords["download_progress_hook"](0, keywords["size"])
+            span.lap("lock_wait_seconds")
+            #  Sharded output is complete once its manifest is written.
+            reuse = os.path.exists(
+                manifest_path(to_location) if shards else to_location
+            )
+        span.set(reused=reuse)
+
+        try:
+            if reuse:
+                logging.info(f"Reusing {to_location} fetched by another process.")
+                with _CompletionManager(download_completion_hook):
+                    pass
+                with _CompletionManager(decompress_completion_hook):
+                    pass
+                return None
+            return _download_and_decompress(
+                to_location=to_location,
+                download_completion_hook=download_completion_hook,
+                decompress_completion_hook=decompress_completion_hook,
+                shards=shards,
+                **keywords,
+            )
+        finally:
+            lock.release()
+
+
+def automatic_resolve_to_location(_from_location: str, _will_decompress: bool) -> str:
     """Holds logic for automatic destination assignment/file suffix cleanup."""
 
     last_term = _from_location.split("/")[-1]
@@ -178,7 +491,7 @@ def base_download(
     from_location: str,
     to_location: Optional[str],
     size: int,
-    session: requests.Session,
+    session: "requests.Session",
     sha1: str,
     decompress: bool,
     download_progress_hook: ProgressHookType,
@@ -186,16 +499,30 @@ def base_download(
     decompress_progress_hook: ProgressHookType,
     decompress_completion_hook: CompletionHookType,
     chunk_size: int = 1024,
+    store: Optional[BlobStore] = None,
+    retry: RetryPolicy = RetryPolicy(),
+    shards: Optional[int] = None,
+    sink: Optional[Sink] = None,
+    bandwidth: Optional[BandwidthGovernor] = None,
+    temp_dir: Optional[str] = None,
 ):
     """Contains core logic for path resolution, compression type resolution,
-    shook resolution, and threading."""
+    shook resolution, and threading.
+
+    If sink is given, output is written to it instead of to_location, and since the
+    output is not a local file, concurrent downloads to the same sink are not merged."""
 
     to_location = (
         to_location
         if to_location is not None
-        else _automatic_resolve_to_location(from_location, decompress)
+        else automatic_resolve_to_location(from_location, decompress)
     )
 
+    assert not shards or automatic_resolve_to_location(
+        from_location, decompress
+    ).endswith(".xml"), "Shards are only written for decompressed XML files."
+    assert not (shards and sink), "Shards are only written to local files."
+
     if not decompress:
         compression_type = None
     elif from_location.endswith(".gz"):
@@ -218,14 +545,24 @@ def base_download(
         "session": session,
         "sha1": sha1,
         "chunk_size": chunk_size,
+        "store": store,
+        "retry": retry,
+        "bandwidth": bandwidth,
+        "temp_dir": temp_dir,
+        "shards": shards,
         "compression_type": compression_type,
         "download_progress_hook": progress_noop_if_none(download_progress_hook),
         "download_completion_hook": completion_noop_if_none(download_completion_hook),
         "decompress_progress_hook": progress_noop_if_none(decompress_progress_hook),
-        "decompress_completion_hook": completion_noop_if_none(decompress_completion_hook),
+        "decompress_completion_hook": completion_noop_if_none(
+            decompress_completion_hook
+        ),
     }
 
-    func = functools.partial(_download_and_decompress, **keywords)
+    if sink is None:
+        func = functools.partial(_download_once, **keywords)
+    else:
+        func = functools.partial(_download_and_decompress, sink=sink, **keywords)
 
     thread = threading.Thread(target=func)
     thread.start()
@@ -0,0 +1,176 @@
+"""Holds a streaming reader for Wikidata entity dumps (json, json.bz2 or json.gz), which
+hold one JSON entity per line inside a single JSON array.
+
+Lines are cut into batches on the reading thread, and batches are decoded and projected
+by a process pool, so decoding scales with cores instead of running in one Python loop.
+Decompression still runs on the reading thread, so for bz2 dumps that are read more than
+once, decompressing once with WikiDump.download and reading the .json file is faster."""
+
+import concurrent.futures
+import json
+import os
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+LANGUAGE_FIELDS = ("labels", "descriptions", "aliases")
+
+
+class Projection(NamedTuple):
+    """Which parts of each entity to keep, None keeps everything.
+
+    fields are top-level keys (id is always kept), properties limits claims to those
+    property ids (such as 'P31'), and languages limits labels, descriptions and aliases
+    to those language codes. If compact, language maps are reduced to their values and
+    claims to the datavalue values of their main snaks."""
+
+    fields: Optional[Sequence[str]] = None
+    properties: Optional[Sequence[str]] = None
+    languages: Optional[Sequence[str]] = None
+    compact: bool = True
+
+
+def _compact_claims(claims: Dict[str, list]) -> Dict[str, list]:
+    return {
+        property_id: [
+            statement["mainsnak"].get("datavalue", {}).get("value")
+            for statement in statements
+        ]
+        for property_id, statements in claims.items()
+    }
+
+
+def _compact_language_map(field: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    if field == "aliases":
+        return {
+            language: [alias["value"] for alias in aliases]
+            for language, aliases in values.items()
+        }
+    return {language: value["value"] for language, value in values.items()}
+
+
+def project(entity: dict, projection: Projection) -> dict:
+    """Gets the parts of entity selected by projection."""
+
+    if projection.fields is not None:
+        entity = {
+            key: value
+            for key, value in entity.items()
+            if key == "id" or key in projection.fields
+        }
+
+    if projection.properties is not None and "claims" in entity:
+        entity["claims"] = {
+            property_id: entity["claims"][property_id]
+            for property_id in projection.properties
+            if property_id in entity["claims"]
+        }
+
+    for field in LANGUAGE_FIELDS:
+        if field not in entity:
+            continue
+        if projection.languages is not None:
+            entity[field] = {
+                language: entity[field][language]
+                for language in projection.languages
+                if language in entity[field]
+            }
+        if projection.compact:
+            entity[field] = _compact_language_map(field, entity[field])
+
+    if projection.compact and "claims" in entity:
+        entity["claims"] = _compact_claims(entity["claims"])
+
+    return entity
+
+
+def decode_batch(batch: bytes, projection: Projection) -> List[dict]:
+    """Decodes and projects every entity line in batch, skipping the array brackets."""
+
+    entities = []
+    for line in batch.split(b"\n"):
+        line = line.strip().rstrip(b",")
+        if not line or line in (b"[", b"]"):
+            continue
+        entities.append(project(json.loads(line), projection))
+    return entities
+
+
+def _open(source: str) -> IO[bytes]:
+    """Opens an entity dump by its extension."""
+
+    # pylint: disable=import-outside-toplevel
+    extension = os.path.splitext(source)[1]
+    if extension == ".bz2":
+        import bz2
+
+        return bz2.open(source, "rb")
+    if extension == ".gz":
+        import gzip
+
+        return gzip.open(source, "rb")
+    return open(source, "rb")  # pylint: disable=consider-using-with
+
+
+def _iter_batches(f_buffer: IO[bytes], batch_bytes: int) -> Iterator[bytes]:
+    """Reads f_buffer in blocks of about batch_bytes, each cut after a whole line."""
+
+    remainder = b""
+    while block := f_buffer.read(batch_bytes):
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            remainder = block
+            continue
+        remainder = block[cut:]
+        yield block[:cut]
+    if remainder:
+        yield remainder
+
+
+def iter_entities(
+    source: Union[str, IO[bytes]],
+    fields: Optional[Sequence[str]] = None,
+    properties: Optional[Sequence[str]] = None,
+    languages: Optional[Sequence[str]] = None,
+    compact: bool = True,
+    processes: Optional[int] = None,
+    batch_bytes: int = 1024 * 1024 * 4,
+) -> Iterator[dict]:
+    """Yields every entity of an entity dump, in dump order, projected (see Projection).
+
+    source is a path (decompressed by its extension) or a binary file object, such as a
+    decompression stream. processes defaults to the number of cpus, and 0 decodes on the
+    calling thread. At most two batches per process are read ahead of the consumer."""
+
+    projection = Projection(
+        tuple(fields) if fields is not None else None,
+        tuple(properties) if properties is not None else None,
+        tuple(languages) if languages is not None else None,
+        compact,
+    )
+    processes = (os.cpu_count() or 1) if processes is None else processes
+
+    f_buffer = _open(source) if isinstance(source, str) else source
+    try:
+        batches = _iter_batches(f_buffer, batch_bytes)
+
+        if processes == 0:
+            for batch in batches:
+                yield from decode_batch(batch, projection)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            pending: List[concurrent.futures.Future] = []
+            try:
+                for batch in batches:
+                    pending.append(executor.submit(decode_batch, batch, projection))
+                    if len(pending) >= processes * 2:
+                        yield from pending.pop(0).result()
+                while pending:
+                    yield from pending.pop(0).result()
+            finally:
+                #  The consumer stopped early, don't decode batches nobody will read.
+                for future in pending:
+                    future.cancel()
+    finally:
+        if isinstance(source, str):
+            f_buffer.close()
@@ -0,0 +1,149 @@
+"""Holds cross-process coordination primitives, used so that several processes can share
+one cache directory or destination volume without reading partial files or
+fetching the same resource twice."""
+
+import contextlib
+import os
+import time
+import uuid
+from typing import Optional, IO, Iterator
+
+try:
+    import fcntl
+
+    msvcrt = None  # pylint: disable=invalid-name
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+
+LOCK_EXTENSION = ".lock"
+PARTIAL_EXTENSION = ".part"
+
+
+def lock_path_for(path: str) -> str:
+    """Gets the sidecar lock file path that guards path. The lock file is hidden
+    and lives next to the guarded file, so it is on the same volume."""
+
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}{LOCK_EXTENSION}")
+
+
+def _try_lock(file_descriptor: int) -> bool:
+    """Attempts to take an exclusive lock on an open file without blocking."""
+
+    try:
+        if fcntl is not None:
+            fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:  # pragma: no cover
+            msvcrt.locking(file_descriptor, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(file_descriptor: int) -> None:
+    """Releases a lock taken with _try_lock."""
+
+    if fcntl is not None:
+        fcntl.flock(file_descriptor, fcntl.LOCK_UN)
+    else:  # pragma: no cover
+        msvcrt.locking(file_descriptor, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """An exclusive, advisory lock held on a lock file. The operating system releases
+    the lock if the holding process dies, so a crashed worker never leaves a stale lock.
+
+    Locks are per open file, so threads of the same process exclude each other too."""
+
+    path: str
+    poll_interval: float
+    _file_descriptor: Optional[int]
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._file_descriptor = None
+
+    @property
+    def locked(self) -> bool:
+        """Whether this instance currently holds the lock."""
+
+        return self._file_descriptor is not None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """Acquires the lock, returning whether it was acquired. If blocking, waits
+        until the lock is free or the optional timeout (in seconds) has passed."""
+
+        assert not self.locked, "lock is already held by this instance"
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            file_descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if _try_lock(file_descriptor):
+                if self._is_current(file_descriptor):
+                    self._file_descriptor = file_descriptor
+                    return True
+                #  The previous holder removed the lock file while we were opening it,
+                #  so our lock is on an orphaned file. Try again on the new one.
+                _unlock(file_descriptor)
+                os.close(file_descriptor)
+                continue
+            os.close(file_descriptor)
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(self.poll_interval)
+
+    def _is_current(self, file_descriptor: int) -> bool:
+        """Checks that the locked file is still the file at self.path."""
+
+        try:
+            return os.path.samestat(os.fstat(file_descriptor), os.stat(self.path))
+        except FileNotFoundError:
+            return False
+
+    def release(self) -> None:
+        """Releases the lock and removes the lock file."""
+
+        assert self.locked, "lock is not held by this instance"
+
+        file_descriptor, self._file_descriptor = self._file_descriptor, None
+        if fcntl is not None:
+            #  Removed while still locked, waiters will notice the new inode and retry.
+            #  Windows cannot remove open files, so lock files are left in place there.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+        _unlock(file_descriptor)
+        os.close(file_descriptor)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "wb", **kwargs) -> Iterator[IO]:
+    """Opens a hidden partial file next to path for writing, then renames it over
+    path once the block exits without error. Readers never observe a partial file."""
+
+    assert "w" in mode, "atomic_open is only for writing"
+
+    directory, name = os.path.split(os.path.abspath(path))
+    partial_path = os.path.join(
+        directory, f".{name}.{uuid.uuid4().hex}{PARTIAL_EXTENSION}"
+    )
+
+    try:
+        with open(partial_path, mode.replace("w", "x"), **kwargs) as f_buffer:
+            yield f_buffer
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_path)
+        raise
+
+    os.replace(partial_path, path)
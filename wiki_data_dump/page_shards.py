@@ -0,0 +1,153 @@
+"""Holds a writer that splits decompressed XML dumps into shards of about equal size,
+cut only at </page> boundaries, so downstream consumers can process shards in parallel
+without scanning for page boundaries themselves."""
+
+import contextlib
+import json
+import os
+from typing import List, Optional, IO
+
+from wiki_data_dump.locking import atomic_open
+
+PAGE_START = b"<page>"
+PAGE_END = b"</page>"
+DOCUMENT_END = b"</mediawiki>\n"
+MANIFEST_SUFFIX = ".shards.json"
+
+_MAX_HEADER_BYTES = (
+    1024 * 1024 * 16
+)  # Past this without a <page>, the file is not paged.
+
+
+def shard_path(to_file_path: str, index: int) -> str:
+    """Gets the path of shard index, in the format '[root]-[index][extension]'."""
+
+    root, extension = os.path.splitext(to_file_path)
+    return f"{root}-{index:05d}{extension}"
+
+
+def manifest_path(to_file_path: str) -> str:
+    """Gets the path of the shard manifest written for to_file_path."""
+
+    return f"{os.path.splitext(to_file_path)[0]}{MANIFEST_SUFFIX}"
+
+
+class PageShardWriter:  # pylint: disable=too-many-instance-attributes
+    """Writes a decompressed XML dump to up to n_shards shard files.
+
+    Everything before the first <page> (the <mediawiki> tag and <siteinfo>) is copied to
+    the start of every shard, and every shard but the last is closed with </mediawiki>,
+    so each shard is a valid dump on its own. Since the decompressed size is unknown
+    while streaming, it is estimated from the compression ratio so far (see observe),
+    and a shard is closed at the first </page> after it reaches its share of that
+    estimate. Once closed, a manifest describing the shards is written next to them.
+    """
+
+    def __init__(self, to_file_path: str, n_shards: int):
+        assert n_shards > 0
+        self.to_file_path = to_file_path
+        self.n_shards = n_shards
+        self.estimated_size: Optional[int] = None
+        self.shards: List[dict] = []
+        self._header: Optional[bytes] = None
+        self._pending = b""
+        self._written = 0  # Decompressed content bytes written across shards.
+        self._stack = contextlib.ExitStack()
+        self._file: Optional[IO[bytes]] = None
+
+    def observe(self, consumed: int, compressed_size: Optional[int]) -> None:
+        """Updates the decompressed size estimate after consuming bytes of the
+        compressed file of size compressed_size."""
+
+        if consumed and compressed_size:
+            written = self._written + len(self._pending)
+            self.estimated_size = int(written * compressed_size / consumed)
+
+    def _open_shard(self) -> None:
+        path = shard_path(self.to_file_path, len(self.shards))
+        self._file = self._stack.enter_context(atomic_open(path, "wb"))
+        self._file.write(self._header)
+        self.shards.append(
+            {"path": os.path.basename(path), "bytes": len(self._header), "pages": 0}
+        )
+
+    def _write(self, content: bytes) -> None:
+        self._file.write(content)
+        self._written += len(content)
+        self.shards[-1]["bytes"] += len(content)
+        self.shards[-1]["pages"] += content.count(PAGE_END)
+
+    def _shard_is_full(self) -> bool:
+        if self.estimated_size is None or len(self.shards) >= self.n_shards:
+            return False
+        return self._written >= self.estimated_size * len(self.shards) / self.n_shards
+
+    def write(self, content: bytes) -> int:
+        """Writes decompressed content, returns the number of bytes accepted."""
+
+        if self._header is None:
+            self._pending += content
+            start = self._pending.find(PAGE_START)
+            if start < 0 and len(self._pending) < _MAX_HEADER_BYTES:
+                return len(content)
+            #  Cut at the start of the <page> line, leaving its indentation to the page.
+            start = self._pending.rfind(b"\n", 0, start) + 1 if start >= 0 else 0
+            self._header, self._pending = self._pending[:start], self._pending[start:]
+            self._open_shard()
+        else:
+            self._pending += content
+
+        while self._shard_is_full():
+            end = self._pending.find(PAGE_END)
+            if end < 0:
+                break
+            end += len(PAGE_END)
+            if self._pending[end : end + 1] == b"\n":
+                end += 1
+            self._write(self._pending[:end])
+            self._pending = self._pending[end:]
+            self._file.write(DOCUMENT_END)
+            self.shards[-1]["bytes"] += len(DOCUMENT_END)
+            self._stack.close()
+            self._open_shard()
+
+        #  Keep a tail that may hold the start of a </page> split across writes.
+        cut = max(len(self._pending) - len(PAGE_END) + 1, 0)
+        self._write(self._pending[:cut])
+        self._pending = self._pending[cut:]
+        return len(content)
+
+    def close(self) -> None:
+        """Writes remaining content, closes the last shard and writes the manifest."""
+
+        if self._header is None:
+            self._header = b""
+            self._open_shard()
+        self._write(self._pending)
+        self._pending = b""
+        self._stack.close()
+
+        with atomic_open(manifest_path(self.to_file_path), "w", encoding="utf8") as f:
+            json.dump(
+                {"header_bytes": len(self._header), "shards": self.shards}, f, indent=1
+            )
+
+    def abort(self) -> None:
+        """Removes every shard written so far."""
+
+        with contextlib.suppress(Exception):
+            self._stack.__exit__(RuntimeError, RuntimeError("aborted"), None)
+        for shard in self.shards[:-1]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(
+                    os.path.join(os.path.dirname(self.to_file_path), shard["path"])
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,135 @@
+"""Holds a process-wide registry of parsed mirror indices, so that WikiDump instances
+for the same mirror share one parsed index and one set of materialized Wikis."""
+
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Optional
+
+
+class WikiCache(collections.OrderedDict):
+    """A thread-safe mapping from wiki name to Wiki that evicts the least recently
+    used Wiki once it holds more than max_size (if max_size is not None)."""
+
+    def __init__(self, max_size: Optional[int] = None):
+        super().__init__()
+        self.max_size = max_size
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while self.max_size is not None and len(self) > self.max_size:
+                self.popitem(last=False)
+
+
+@dataclass
+class IndexEntry:
+    """A parsed index shared between WikiDump instances, with the Wikis built from it."""
+
+    index: dict
+    wikis: WikiCache
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the index was loaded."""
+
+        return time.monotonic() - self.loaded_at
+
+
+class IndexRegistry:
+    """Holds one IndexEntry per key (a mirror and cache dir).
+
+    Entries younger than ttl seconds are returned as they are. Entries older than ttl but
+    younger than ttl + stale_while_revalidate are still returned, while a background
+    thread reloads them. Older entries are reloaded before returning. Concurrent callers
+    for a missing or expired entry wait on a single load."""
+
+    ttl: float
+    stale_while_revalidate: float
+    max_wikis: Optional[int]
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        stale_while_revalidate: float = 3600.0,
+        max_wikis: Optional[int] = 256,
+    ):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_wikis = max_wikis
+        self._entries: Dict[Hashable, IndexEntry] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key: Hashable, loader: Callable[[], dict]) -> IndexEntry:
+        """Gets the entry for key, using loader to parse the index when it
+        is missing or expired."""
+
+        entry = self._entries.get(key)
+
+        if entry is not None and entry.age < self.ttl:
+            return entry
+
+        if entry is not None and entry.age < self.ttl + self.stale_while_revalidate:
+            self._refresh_in_background(key, loader)
+            return entry
+
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is None or entry.age >= self.ttl + self.stale_while_revalidate:
+                entry = self._load(key, loader)
+        return entry
+
+    def _load(self, key: Hashable, loader: Callable[[], dict]) -> IndexEntry:
+        entry = IndexEntry(loader(), WikiCache(self.max_wikis))
+        self._entries[key] = entry
+        return entry
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], dict]):
+        """Starts a reload of key, unless one is already running."""
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with self._key_lock(key):
+                    self._load(key, loader)
+            except Exception as exc:  # pylint: disable=broad-except
+                #  The stale entry stays in use, and the next get retries.
+                logging.warning(f"Background index refresh failed: {exc}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drops the entry for key, or every entry if key is None."""
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+DEFAULT_REGISTRY = IndexRegistry()
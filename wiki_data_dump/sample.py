@@ -0,0 +1,245 @@
+"""Holds partial reads of dump files, which stream and decompress only as many bytes as
+it takes to read the first records of a file (XML pages, SQL rows or lines), for schema
+checks and quick experiments on dumps too large to download whole.
+
+Multistream bz2 dumps (such as pages-articles-multistream.xml.bz2) can also be sampled
+from the middle, by starting at a stream offset listed in their -index.txt.bz2 file."""
+
+import contextlib
+import logging
+import os
+import re
+from typing import Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+from wiki_data_dump import trace
+
+if TYPE_CHECKING:
+    import requests
+
+RECORD_TYPES = ("page", "row", "line")
+
+PAGE_START = b"<page>"
+PAGE_END = b"</page>"
+_INSERT = re.compile(rb"INSERT INTO [^\s]+ VALUES ")
+
+
+def record_type_for(url: str) -> str:
+    """Guesses the record type of a file from its name."""
+
+    name = re.sub(r"\.(gz|bz2)$", "", url.split("/")[-1])
+    extension = os.path.splitext(name)[1]
+    return {".xml": "page", ".sql": "row"}.get(extension, "line")
+
+
+def _decompressor(compression: Optional[str]):
+    # pylint: disable=import-outside-toplevel
+    #  Imported here since compression modules are only needed once sampling.
+    if compression == "bz2":
+        import bz2
+
+        return bz2.BZ2Decompressor()
+    if compression == "gz":
+        import zlib
+
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return None
+
+
+def _iter_decompressed(
+    chunks: Iterable[bytes], compression: Optional[str]
+) -> Iterator[bytes]:
+    """Decompresses chunks incrementally, following multistream bz2 and multi-member gz
+    files from one stream into the next."""
+
+    if compression is None:
+        yield from chunks
+        return
+
+    decompressor = _decompressor(compression)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = _decompressor(compression)
+
+
+def _iter_pages(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each <page> element in chunks."""
+
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            start = buffer.find(PAGE_START)
+            if start < 0:
+                buffer = buffer[-len(PAGE_START) + 1 :]
+                break
+            end = buffer.find(PAGE_END, start)
+            if end < 0:
+                buffer = buffer[start:]
+                break
+            end += len(PAGE_END)
+            yield buffer[start:end]
+            buffer = buffer[end:]
+
+
+def _iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each non-empty line in chunks, without its line break."""
+
+    buffer = b""
+    for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        yield from (line for line in lines if line.strip())
+    if buffer.strip():
+        yield buffer
+
+
+class _RowSplitter:  # pylint: disable=too-few-public-methods
+    """Splits INSERT statements into value tuples, such as (1,'Title',0), as they are
+    fed. Parentheses and semicolons inside quoted strings are not mistaken for syntax.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.position = 0
+        self.in_values = False
+        self.row_start = 0
+        self.depth = 0
+        self.quoted = False
+        self.escaped = False
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        """Yields the rows completed by chunk."""
+
+        self.buffer += chunk
+        while self._find_values():
+            yield from self._scan()
+            if self.in_values:
+                break
+
+        #  Keep the unfinished row, or enough to find a statement split across chunks.
+        if self.depth:
+            cut = self.row_start
+        elif self.in_values:
+            cut = self.position
+        else:
+            cut = max(self.position, len(self.buffer) - 256)
+        self.buffer = self.buffer[cut:]
+        self.position -= cut
+        self.row_start = 0
+
+    def _find_values(self) -> bool:
+        """Moves to the values of the next INSERT statement, unless already in them.
+        Returns whether there are values to scan."""
+
+        if not self.in_values:
+            match = _INSERT.search(self.buffer, self.position)
+            if match is None:
+                return False
+            self.in_values, self.position = True, match.end()
+        return self.position < len(self.buffer)
+
+    def _scan(self) -> Iterator[bytes]:
+        """Yields rows until the end of the statement or of the buffer."""
+
+        while self.position < len(self.buffer):
+            byte = self.buffer[self.position : self.position + 1]
+            self.position += 1
+            if self.quoted:
+                if self.escaped:
+                    self.escaped = False
+                elif byte == b"\\":
+                    self.escaped = True
+                elif byte == b"'":
+                    self.quoted = False
+            elif byte == b"'":
+                self.quoted = True
+            elif byte == b"(":
+                self.depth += 1
+                if self.depth == 1:
+                    self.row_start = self.position - 1
+            elif byte == b")":
+                self.depth -= 1
+                if self.depth == 0:
+                    yield self.buffer[self.row_start : self.position]
+            elif byte == b";" and self.depth == 0:
+                self.in_values = False
+                return
+
+
+def _iter_rows(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each value tuple of INSERT statements in chunks."""
+
+    splitter = _RowSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+
+
+_SPLITTERS = {"page": _iter_pages, "row": _iter_rows, "line": _iter_lines}
+
+
+def head(
+    session: "requests.Session",
+    url: str,
+    n: int,
+    record: Optional[str] = None,
+    compression: Optional[str] = None,
+    offset: int = 0,
+    max_bytes: Optional[int] = None,
+    chunk_size: int = 1024 * 64,
+) -> List[bytes]:
+    """Gets the first n records of the file at url, reading only as much of it as
+    needed, and closing the connection as soon as n records are decompressed.
+
+    record is 'page', 'row' or 'line' (see RECORD_TYPES), guessed from the file name by
+    default. compression ('bz2', 'gz' or None) is also guessed from the file name.
+    offset starts reading at that byte with a range request, which must be the start of
+    a compressed stream for compressed files (such as an offset from a multistream
+    index). max_bytes caps the compressed bytes requested, so fewer than n records are
+    returned if they do not fit."""
+
+    if n <= 0:
+        return []
+
+    record = record or record_type_for(url)
+    assert record in RECORD_TYPES, f"record must be one of {RECORD_TYPES}"
+    if compression is None and url.endswith((".bz2", ".gz")):
+        compression = url.rsplit(".", 1)[1]
+
+    headers = {}
+    if offset or max_bytes:
+        end = "" if max_bytes is None else str(offset + max_bytes - 1)
+        headers["Range"] = f"bytes={offset}-{end}"
+
+    records = []
+    transferred = 0
+
+    with trace.span("head", "sample", url=url, n=n) as span:
+        response = session.get(url, headers=headers, stream=True, timeout=10.0)
+
+        def compressed_chunks() -> Iterator[bytes]:
+            nonlocal transferred
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                transferred += len(chunk)
+                yield chunk
+                if max_bytes is not None and transferred >= max_bytes:
+                    return
+
+        with contextlib.closing(response):
+            response.raise_for_status()
+            if offset and getattr(response, "status_code", 206) != 206:
+                raise ValueError(f"{url} does not support range requests.")
+
+            for item in _SPLITTERS[record](
+                _iter_decompressed(compressed_chunks(), compression)
+            ):
+                records.append(item)
+                if len(records) >= n:
+                    break
+
+        span.set(bytes=transferred, records=len(records))
+
+    logging.info(f"Read {len(records)} records from {transferred} bytes of {url}.")
+    return records
@@ -0,0 +1,253 @@
+"""Holds a scheduler that orders a batch of downloads by size, and admits each one only
+once the target and temporary volumes have room for everything it will write.
+
+While a file downloads, its compressed copy sits in a temporary file, and while it
+decompresses, the decompressed output grows next to it, so a download needs room for
+both at once. Decompressed sizes are not in the index, so they are estimated from the
+compressed size with expansion ratios (see DEFAULT_EXPANSION_RATIOS)."""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import wiki_data_dump.api_response
+import wiki_data_dump.download
+
+POLICIES = ("largest_first", "shortest_first")
+
+#  Decompressed size over compressed size, by pattern searched in file names, first match
+#  wins. These are rough upper estimates for dump files, pass measured ratios where
+#  they are known, since an underestimate is what lets a download run out of disk.
+DEFAULT_EXPANSION_RATIOS: Dict[str, float] = {
+    r"pages-meta-history.*\.bz2$": 30.0,
+    r"\.bz2$": 6.0,
+    r"\.gz$": 5.0,
+}
+
+
+class Planned(NamedTuple):
+    """A download with the bytes it needs on each volume, keyed by device id."""
+
+    file: wiki_data_dump.api_response.File
+    destination: str
+    output_size: int
+    needs: Dict[int, int]
+
+
+class Result(NamedTuple):
+    """A finished (or rejected) download, with the error that stopped it, if any."""
+
+    file: wiki_data_dump.api_response.File
+    destination: str
+    error: Optional[BaseException]
+
+
+class _Volume:  # pylint: disable=too-few-public-methods
+    """Free space accounting of one device during a batch.
+
+    Free space is measured when nothing scheduled is writing to the device. Until then,
+    bytes reserved by running downloads and kept by finished ones are subtracted from
+    that measure, instead of measuring again while partial files are half written."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.measured_free = shutil.disk_usage(path).free
+        self.reserved = 0
+        self.kept = 0
+        self.active = 0
+
+    def available(self) -> int:
+        """Bytes that can still be reserved on the device."""
+
+        if not self.active:
+            self.measured_free = shutil.disk_usage(self.path).free
+            self.kept = 0
+        return self.measured_free - self.reserved - self.kept
+
+
+class DownloadScheduler:  # pylint: disable=too-many-instance-attributes
+    """Downloads files to destination_dir with up to max_parallel at once, in policy
+    order: 'largest_first' (which shortens the whole batch, as large files do not start
+    last) or 'shortest_first' (which finishes most files soonest).
+
+    A download is started only once every volume it writes to (the destination's and
+    temp_dir's, which may be the same) keeps margin bytes free after it, even if it and
+    every running download write their full estimated sizes. A file that does not fit
+    is skipped for smaller ones that do, and is rejected if it does not fit even once
+    nothing else is running."""
+
+    def __init__(
+        self,
+        wiki_dump,
+        destination_dir: str,
+        max_parallel: int = 4,
+        policy: str = "largest_first",
+        decompress: bool = True,
+        temp_dir: Optional[str] = None,
+        margin: int = 1024 * 1024 * 1024,
+        expansion_ratios: Optional[Dict[str, float]] = None,
+    ):
+        assert policy in POLICIES, f"policy must be one of {POLICIES}"
+        assert max_parallel > 0
+        self.wiki_dump = wiki_dump
+        self.destination_dir = destination_dir
+        self.max_parallel = max_parallel
+        self.policy = policy
+        self.decompress = decompress
+        self.temp_dir = temp_dir if temp_dir is not None else tempfile.gettempdir()
+        self.margin = margin
+        self.expansion_ratios = (
+            DEFAULT_EXPANSION_RATIOS if expansion_ratios is None else expansion_ratios
+        )
+        self._volumes: Dict[int, _Volume] = {}
+        self._running = 0
+        self._condition = threading.Condition()
+
+    def output_size(self, file: wiki_data_dump.api_response.File) -> int:
+        """Estimates the size of a file's output, decompressed if it will be."""
+
+        size = file.size or 0
+        if not self.decompress:
+            return size
+        name = file.url.split("/")[-1]
+        for pattern, ratio in self.expansion_ratios.items():
+            if re.search(pattern, name):
+                return int(size * ratio)
+        return size
+
+    def plan(self, files: Iterable[wiki_data_dump.api_response.File]) -> List[Planned]:
+        """Gets the downloads of files in policy order, with their disk needs."""
+
+        os.makedirs(self.destination_dir, exist_ok=True)
+        destination_device = os.stat(self.destination_dir).st_dev
+        temp_device = os.stat(self.temp_dir).st_dev
+
+        planned = []
+        for file in files:
+            if file.size is None:
+                logging.warning(f"{file.url} lists no size, so it is scheduled last.")
+            output_size = self.output_size(file)
+            needs = {destination_device: output_size}
+            #  The compressed temporary file exists until decompression finishes.
+            needs[temp_device] = needs.get(temp_device, 0) + (file.size or 0)
+            destination = os.path.join(
+                self.destination_dir,
+                wiki_data_dump.download.automatic_resolve_to_location(
+                    file.url, self.decompress
+                ),
+            )
+            planned.append(Planned(file, destination, output_size, needs))
+
+        def key(item: Planned) -> Tuple[bool, int]:
+            size = item.file.size or 0
+            return (
+                item.file.size is None,
+                -size if self.policy == "largest_first" else size,
+            )
+
+        return sorted(planned, key=key)
+
+    def _volume(self, device: int) -> _Volume:
+        if device not in self._volumes:
+            path = (
+                self.destination_dir
+                if os.stat(self.destination_dir).st_dev == device
+                else self.temp_dir
+            )
+            self._volumes[device] = _Volume(path)
+        return self._volumes[device]
+
+    def _fits(self, item: Planned) -> bool:
+        return all(
+            self._volume(device).available() - need >= self.margin
+            for device, need in item.needs.items()
+        )
+
+    def _reserve(self, item: Planned) -> None:
+        self._running += 1
+        for device, need in item.needs.items():
+            volume = self._volume(device)
+            volume.reserved += need
+            volume.active += 1
+
+    def _release(self, item: Planned, completed: bool) -> None:
+        """Releases a download's reservations, keeping its output's bytes if it
+        completed, since the output stays on disk."""
+
+        self._running -= 1
+        destination_device = os.stat(self.destination_dir).st_dev
+        for device, need in item.needs.items():
+            volume = self._volume(device)
+            volume.reserved -= need
+            volume.active -= 1
+            if completed and device == destination_device:
+                volume.kept += item.output_size
+
+    def _fetch(self, item: Planned, results: List[Result]) -> None:
+        errors: List[BaseException] = []
+
+        def completion_hook(_exc_type, exc_val, _exc_tb):
+            if exc_val is not None:
+                errors.append(exc_val)
+            return True  # Reported in results, so not raised on the download thread.
+
+        try:
+            self.wiki_dump.download(
+                item.file,
+                item.destination,
+                decompress=self.decompress,
+                download_completion_hook=completion_hook,
+                decompress_completion_hook=completion_hook,
+                temp_dir=self.temp_dir,
+            ).join()
+        except Exception as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+
+        with self._condition:
+            self._release(item, completed=not errors)
+            results.append(Result(item.file, item.destination, (errors or [None])[0]))
+            self._condition.notify_all()
+
+    def _start_fitting(self, pending: List[Planned], results: List[Result]) -> None:
+        """Starts pending downloads that fit, in order, and rejects those that do not
+        fit with nothing else running. Called while holding the condition."""
+
+        for item in list(pending):
+            if self._running >= self.max_parallel:
+                return
+            if self._fits(item):
+                pending.remove(item)
+                self._reserve(item)
+                threading.Thread(
+                    target=self._fetch, args=(item, results), daemon=True
+                ).start()
+            elif not self._running:
+                pending.remove(item)
+                logging.warning(f"Not enough disk space for {item.destination}.")
+                results.append(
+                    Result(
+                        item.file,
+                        item.destination,
+                        OSError(f"Not enough disk space for {item.destination}."),
+                    )
+                )
+
+    def run(self, files: Iterable[wiki_data_dump.api_response.File]) -> List[Result]:
+        """Downloads every file that fits, returns results in the order downloads
+        finished, or were rejected for lack of disk space."""
+
+        pending = self.plan(files)
+        results: List[Result] = []
+
+        with self._condition:
+            self._volumes.clear()
+            while pending or self._running:
+                self._start_fitting(pending, results)
+                if self._running:
+                    self._condition.wait()
+
+        return results
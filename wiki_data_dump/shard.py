@@ -0,0 +1,302 @@
+"""Holds logic for splitting a data dump into byte-balanced shards, and for running
+shards on several machines that share a filesystem."""
+
+import bisect
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Tuple, Optional, Iterable
+
+import wiki_data_dump.download
+
+FileKey = Tuple[str, str, str]  # (wiki_name, job_name, file_name), as from iter_files.
+
+CLAIM_EXTENSION = ".claim"
+DONE_EXTENSION = ".done"
+
+
+def _ring_position(key: str) -> int:
+    """Stable position of a key on the hash ring, identical in every process."""
+
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+@dataclass
+class Shard:
+    """A unit of work that a single worker claims, holding file keys and their total size."""
+
+    index: int
+    files: List[FileKey] = field(default_factory=list)
+    size: int = 0
+
+
+@dataclass
+class ShardPlan:
+    """A deterministic assignment of files to shards, and of shards to home workers."""
+
+    n_workers: int
+    shards: List[Shard]
+
+    def home_worker(self, shard_index: int) -> int:
+        """The worker that claims a shard first, before any worker steals it."""
+
+        return shard_index % self.n_workers
+
+    def worker_sizes(self) -> List[int]:
+        """Total bytes assigned to each worker by home shards."""
+
+        sizes = [0] * self.n_workers
+        for shard in self.shards:
+            sizes[self.home_worker(shard.index)] += shard.size
+        return sizes
+
+    def to_json(self) -> str:
+        """Serializes the plan, so every node can be given the exact same plan."""
+
+        return json.dumps(
+            {
+                "n_workers": self.n_workers,
+                "shards": [
+                    {"index": s.index, "files": s.files, "size": s.size}
+                    for s in self.shards
+                ],
+            }
+        )
+
+    @classmethod
+    def from_json(cls, content: str) -> "ShardPlan":
+        """Deserializes a plan made with to_json."""
+
+        raw = json.loads(content)
+        return cls(
+            n_workers=raw["n_workers"],
+            shards=[
+                Shard(s["index"], [tuple(f) for f in s["files"]], s["size"])
+                for s in raw["shards"]
+            ],
+        )
+
+
+def plan_shards(
+    wiki_dump,
+    n_workers: int,
+    shards_per_worker: int = 4,
+    files: Optional[Iterable[FileKey]] = None,
+    load_factor: float = 1.05,
+    virtual_nodes: int = 64,
+) -> ShardPlan:
+    """Assigns files (defaults to every file from wiki_dump.iter_files) to shards using
+    consistent hashing with bounded loads, weighted by File.size.
+
+    Each file goes to the first shard clockwise of its hash on the ring that still has room
+    below load_factor times the mean shard size, so shards are balanced by bytes, and
+    changing the number of workers moves few files between shards. Files are placed
+    largest first, which keeps shards close to balanced when a few files dominate."""
+
+    assert n_workers > 0 and shards_per_worker > 0
+    n_shards = n_workers * shards_per_worker
+
+    ring = sorted(
+        (_ring_position(f"shard-{index}-{replica}"), index)
+        for index in range(n_shards)
+        for replica in range(virtual_nodes)
+    )
+    positions = [position for position, _ in ring]
+
+    sized: List[Tuple[int, FileKey]] = []
+    wiki_name, wiki = None, None
+    for key in wiki_dump.iter_files() if files is None else files:
+        #  Building a Wiki parses every job of it, so build each once, not once per file.
+        #  Files come grouped by wiki, so only the last one is kept.
+        if key[0] != wiki_name:
+            wiki_name, wiki = key[0], wiki_dump.get_wiki(key[0], cache=False)
+        file = wiki.jobs[key[1]].get_file(key[2])
+        sized.append((file.size or 0, tuple(key)))
+    sized.sort(key=lambda item: (-item[0], item[1]))
+
+    total = sum(size for size, _ in sized)
+    capacity = load_factor * total / n_shards
+    shards = [Shard(index) for index in range(n_shards)]
+
+    for size, key in sized:
+        start = bisect.bisect(positions, _ring_position("/".join(key)))
+        target = None
+        for offset in range(len(ring)):
+            candidate = shards[ring[(start + offset) % len(ring)][1]]
+            if candidate.size + size <= capacity:
+                target = candidate
+                break
+        if target is None:
+            #  File is larger than any remaining room, so give it to the lightest shard.
+            target = min(shards, key=lambda s: (s.size, s.index))
+        target.files.append(key)
+        target.size += size
+
+    return ShardPlan(n_workers=n_workers, shards=shards)
+
+
+class ShardRunner:  # pylint: disable=too-many-instance-attributes
+    """Downloads the shards of a ShardPlan on one worker, coordinating with other
+    workers through claim files in a shared directory.
+
+    A worker runs its home shards first, then steals shards that are unclaimed or whose
+    claim has not been refreshed for stale_after seconds (the worker stopped making
+    progress). Claim files are created exclusively and stolen by atomic rename, which
+    are safe on shared filesystems where advisory locks are not."""
+
+    def __init__(
+        self,
+        wiki_dump,
+        plan: ShardPlan,
+        shared_dir: str,
+        worker_id: int,
+        destination_dir: str,
+        decompress: bool = False,
+        stale_after: float = 600.0,
+        heartbeat_interval: float = 5.0,
+    ):
+        self.wiki_dump = wiki_dump
+        self.plan = plan
+        self.shared_dir = shared_dir
+        self.worker_id = worker_id
+        self.destination_dir = destination_dir
+        self.decompress = decompress
+        self.stale_after = stale_after
+        self.heartbeat_interval = heartbeat_interval
+        self._last_heartbeat = 0.0
+        os.makedirs(shared_dir, exist_ok=True)
+
+    def _path(self, shard_index: int, extension: str) -> str:
+        return os.path.join(self.shared_dir, f"shard-{shard_index:05d}{extension}")
+
+    def is_done(self, shard_index: int) -> bool:
+        """Whether any worker has finished the shard."""
+
+        return os.path.exists(self._path(shard_index, DONE_EXTENSION))
+
+    def claim(self, shard_index: int) -> bool:
+        """Claims a shard if it is unclaimed, or if its claim is stale. Returns whether
+        this worker now owns the shard."""
+
+        if self.is_done(shard_index):
+            return False
+
+        claim_path = self._path(shard_index, CLAIM_EXTENSION)
+
+        try:
+            claim_stat = os.stat(claim_path)
+        except FileNotFoundError:
+            claim_stat = None
+
+        if claim_stat is not None:
+            if time.time() - claim_stat.st_mtime < self.stale_after:
+                return False
+            stale_path = f"{claim_path}.stale-{uuid.uuid4().hex}"
+            try:
+                #  Only one worker can win the rename of a stale claim.
+                os.rename(claim_path, stale_path)
+            except FileNotFoundError:
+                return False
+            if not os.path.samestat(claim_stat, os.stat(stale_path)):
+                #  Another worker replaced the stale claim first, so this rename moved
+                #  its fresh claim. Put it back unless yet another claim exists.
+                with contextlib.suppress(FileExistsError):
+                    os.link(stale_path, claim_path)
+                os.remove(stale_path)
+                return False
+            os.remove(stale_path)
+            logging.warning(f"Reassigning stale shard {shard_index}.")
+
+        try:
+            file_descriptor = os.open(
+                claim_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644
+            )
+        except FileExistsError:
+            return False
+
+        with os.fdopen(file_descriptor, "w", encoding="utf8") as f_buffer:
+            json.dump(
+                {
+                    "worker": self.worker_id,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                },
+                f_buffer,
+            )
+        return True
+
+    def heartbeat(self, shard_index: int) -> None:
+        """Refreshes a claim so other workers see this worker is making progress."""
+
+        now = time.monotonic()
+        if now - self._last_heartbeat < self.heartbeat_interval:
+            return
+        self._last_heartbeat = now
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self._path(shard_index, CLAIM_EXTENSION))
+
+    def _claim_order(self) -> List[int]:
+        """Home shards first, then every other shard, starting after this worker's
+        home shards so stealing workers spread out."""
+
+        indices = [shard.index for shard in self.plan.shards]
+        home = [i for i in indices if self.plan.home_worker(i) == self.worker_id]
+        other = [i for i in indices if self.plan.home_worker(i) != self.worker_id]
+        rotation = self.worker_id * len(other) // max(self.plan.n_workers, 1)
+        return home + other[rotation:] + other[:rotation]
+
+    def run_shard(self, shard: Shard) -> None:
+        """Downloads every file of a claimed shard, skipping files already in place
+        from an earlier, interrupted owner."""
+
+        for wiki_name, job_name, file_name in shard.files:
+            file = self.wiki_dump.get_file(wiki_name, job_name, file_name, cache=False)
+            destination = os.path.join(
+                self.destination_dir,
+                wiki_name,
+                wiki_data_dump.download.automatic_resolve_to_location(
+                    file_name, self.decompress
+                ),
+            )
+            if os.path.exists(destination):
+                continue
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            self.heartbeat(shard.index)
+            self.wiki_dump.download(
+                file,
+                destination,
+                decompress=self.decompress,
+                download_progress_hook=lambda *_, i=shard.index: self.heartbeat(i),
+                decompress_progress_hook=lambda *_, i=shard.index: self.heartbeat(i),
+            ).join()
+            if not os.path.exists(destination):
+                raise RuntimeError(f"Download of {file_name} failed.")
+
+        with open(self._path(shard.index, DONE_EXTENSION), "w", encoding="utf8"):
+            pass
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(shard.index, CLAIM_EXTENSION))
+
+    def run(self, poll_interval: float = 30.0) -> List[int]:
+        """Runs shards until every shard in the plan is done, waiting on shards claimed by
+        live workers in case they go stale. Returns indices of shards run by this worker.
+        """
+
+        completed: List[int] = []
+        while True:
+            pending = [i for i in self._claim_order() if not self.is_done(i)]
+            if not pending:
+                return completed
+            claimed = next((i for i in pending if self.claim(i)), None)
+            if claimed is None:
+                time.sleep(poll_interval)
+                continue
+            self._last_heartbeat = 0.0
+            self.run_shard(self.plan.shards[claimed])
+            completed.append(claimed)
@@ -0,0 +1,180 @@
+"""Holds sinks, which are where downloads write their (decompressed or raw) output:
+local files, memory, or S3-compatible object storage through a multipart upload.
+
+A sink's open returns a context manager for a writable binary file-like object. Output
+is only committed (renamed into place, kept, or completed as an upload) if the with block
+exits without an error, so a failed or unverified download never leaves partial output.
+"""
+
+import abc
+import concurrent.futures
+import contextlib
+import io
+import threading
+from typing import Any, Dict, List, Optional
+
+from wiki_data_dump.locking import atomic_open
+
+MIN_PART_SIZE = 1024 * 1024 * 5  # S3 rejects smaller parts, except for the last one.
+
+
+class Sink(abc.ABC):  # pylint: disable=too-few-public-methods
+    """Base class of download outputs."""
+
+    @abc.abstractmethod
+    def open(self):
+        """Gets a context manager for a binary writer, committed if the block succeeds."""
+
+
+class LocalFileSink(Sink):  # pylint: disable=too-few-public-methods
+    """Writes to a local file, moved into place once complete."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def open(self):
+        return atomic_open(self.path, "wb")
+
+
+class MemorySink(Sink):  # pylint: disable=too-few-public-methods
+    """Keeps output in memory, as content once complete."""
+
+    def __init__(self):
+        self.content: Optional[bytes] = None
+
+    @contextlib.contextmanager
+    def open(self):
+        buffer = io.BytesIO()
+        yield buffer
+        self.content = buffer.getvalue()
+
+
+class _MultipartWriter(io.RawIOBase):  # pylint: disable=too-many-instance-attributes
+    """Cuts writes into parts and uploads up to max_workers parts at once. Writes block
+    while max_workers parts are in flight, so at most max_workers + 1 parts are held in
+    memory however large the upload is."""
+
+    def __init__(self, sink: "S3MultipartSink"):
+        super().__init__()
+        self.sink = sink
+        self.upload_id: Optional[str] = None
+        self._buffer = bytearray()
+        self._parts: Dict[int, Dict[str, Any]] = {}
+        self._futures: List[concurrent.futures.Future] = []
+        self._checked = 0  # Parts before this one are uploaded.
+        self._in_flight = threading.BoundedSemaphore(sink.max_workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(sink.max_workers)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, content) -> int:
+        self._buffer += content
+        while len(self._buffer) >= self.sink.part_size:
+            self._submit(bytes(self._buffer[: self.sink.part_size]))
+            del self._buffer[: self.sink.part_size]
+        return len(content)
+
+    def _submit(self, body: bytes) -> None:
+        """Starts uploading the next part, once fewer than max_workers are in flight.
+        Raises the error of a failed part, in order, instead of uploading the rest."""
+
+        if self.upload_id is None:
+            self.upload_id = self.sink.client.create_multipart_upload(
+                Bucket=self.sink.bucket, Key=self.sink.key
+            )["UploadId"]
+
+        part_number = len(self._futures) + 1
+        self._in_flight.acquire()  # pylint: disable=consider-using-with
+        try:
+            while self._checked < len(self._futures) and (
+                self._futures[self._checked].done()
+            ):
+                self._futures[self._checked].result()
+                self._checked += 1
+            future = self._executor.submit(self._upload_part, part_number, body)
+        except BaseException:
+            self._in_flight.release()
+            raise
+        #  Released once the future is done, so a part that freed its slot by failing is
+        #  seen as failed by the next _submit.
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number: int, body: bytes) -> None:
+        response = self.sink.client.upload_part(
+            Bucket=self.sink.bucket,
+            Key=self.sink.key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+            Body=body,
+        )
+        self._parts[part_number] = {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def commit(self) -> None:
+        """Uploads the last part, waits for every part, and completes the upload."""
+
+        if self._buffer or not self._futures:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown()
+
+        self.sink.client.complete_multipart_upload(
+            Bucket=self.sink.bucket,
+            Key=self.sink.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": [self._parts[i] for i in sorted(self._parts)]},
+        )
+
+    def abort(self) -> None:
+        """Stops uploading and discards the parts uploaded so far."""
+
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown()
+        if self.upload_id is not None:
+            self.sink.client.abort_multipart_upload(
+                Bucket=self.sink.bucket, Key=self.sink.key, UploadId=self.upload_id
+            )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            try:
+                self.commit()
+            except BaseException:
+                self.abort()
+                raise
+        else:
+            self.abort()
+        super().__exit__(exc_type, exc_val, exc_tb)
+
+
+class S3MultipartSink(Sink):  # pylint: disable=too-few-public-methods
+    """Streams output to an S3-compatible bucket as a multipart upload, through client,
+    a boto3 S3 client or any object with the same create_multipart_upload, upload_part,
+    complete_multipart_upload and abort_multipart_upload methods.
+
+    Parts of part_size bytes (at least MIN_PART_SIZE) are uploaded by up to max_workers
+    threads while the download continues. S3 allows up to 10,000 parts, so objects can be
+    at most 10,000 * part_size bytes."""
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        part_size: int = 1024 * 1024 * 16,
+        max_workers: int = 4,
+    ):
+        assert part_size >= MIN_PART_SIZE, f"Parts must be at least {MIN_PART_SIZE}B."
+        assert max_workers > 0
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+    def open(self):
+        return _MultipartWriter(self)
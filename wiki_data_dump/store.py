@@ -0,0 +1,175 @@
+"""Holds a content-addressed local store of downloaded files, keyed by the sha1 sum
+listed for each File. Files that are unchanged between dump runs are linked from the
+store instead of being downloaded again under their new dated urls."""
+
+import contextlib
+import logging
+import os
+import re
+import uuid
+from typing import List, Optional
+
+from wiki_data_dump.locking import atomic_open, PARTIAL_EXTENSION
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+_FICLONE = 0x40049409  # Linux ioctl request for a copy-on-write clone of a file.
+_sha1_match = re.compile(r"^[0-9a-f]{40}$")
+
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+
+def _reflink(source: str, destination: str) -> None:
+    """Makes a copy-on-write clone of source at destination, raising OSError
+    where the platform or filesystem does not support it."""
+
+    if fcntl is None:  # pragma: no cover
+        raise OSError("reflinks are not supported on this platform")
+
+    with open(source, "rb") as source_obj, open(destination, "xb") as destination_obj:
+        try:
+            fcntl.ioctl(destination_obj.fileno(), _FICLONE, source_obj.fileno())
+        except OSError:
+            destination_obj.close()
+            os.remove(destination)
+            raise
+
+
+class BlobStore:
+    """A directory of blobs named by sha1 sum, in the format
+    '[root]/[first two hex digits]/[sha1]'.
+
+    link_mode chooses how blobs reach their destinations: 'hardlink' shares the blob's
+    inode (blobs are made read-only so destinations cannot corrupt the store),
+    'reflink' makes a copy-on-write clone, and 'copy' copies. Linking falls back to
+    copying when the destination is on another volume or clones are unsupported.
+
+    If max_bytes is set, collect_garbage evicts least recently used blobs, preferring
+    blobs that no destination links to anymore, until the store fits."""
+
+    root: str
+    max_bytes: Optional[int]
+    link_mode: str
+
+    def __init__(
+        self, root: str, max_bytes: Optional[int] = None, link_mode: str = "hardlink"
+    ):
+        assert link_mode in LINK_MODES, f"link_mode must be one of {LINK_MODES}"
+        self.root = root
+        self.max_bytes = max_bytes
+        self.link_mode = link_mode
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, sha1: str) -> str:
+        """Gets the blob path for a sha1 sum, whether or not the blob exists."""
+
+        sha1 = sha1.lower()
+        assert _sha1_match.match(sha1), "sha1 must be a 40 digit hex string"
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def has(self, sha1: Optional[str]) -> bool:
+        """Whether a blob for sha1 is in the store."""
+
+        return bool(sha1) and os.path.exists(self.path_for(sha1))
+
+    def add(self, path: str, sha1: str) -> str:
+        """Adds the verified file at path to the store, returns the blob path."""
+
+        blob_path = self.path_for(sha1)
+        if os.path.exists(blob_path):
+            return blob_path
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        partial_path = f"{blob_path}.{uuid.uuid4().hex}{PARTIAL_EXTENSION}"
+        try:
+            self._link(path, partial_path, self.link_mode)
+            os.chmod(partial_path, 0o444)
+            os.replace(partial_path, blob_path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(partial_path)
+        return blob_path
+
+    def materialize(self, sha1: str, destination: str) -> None:
+        """Atomically places the blob for sha1 at destination, and marks it as used."""
+
+        blob_path = self.path_for(sha1)
+        directory, name = os.path.split(os.path.abspath(destination))
+        partial_path = os.path.join(
+            directory, f".{name}.{uuid.uuid4().hex}{PARTIAL_EXTENSION}"
+        )
+        try:
+            self._link(blob_path, partial_path, self.link_mode)
+            os.replace(partial_path, destination)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(partial_path)
+        os.utime(blob_path)
+
+    @staticmethod
+    def _link(source: str, destination: str, link_mode: str) -> None:
+        """Links or clones source to a new destination by link_mode, copying if that fails."""
+
+        try:
+            if link_mode == "hardlink":
+                os.link(source, destination)
+                return
+            if link_mode == "reflink":
+                _reflink(source, destination)
+                return
+        except OSError as exc:
+            logging.debug(f"Falling back to copying {source}: {exc}")
+
+        # pylint: disable=import-outside-toplevel
+        #  Imported here since shutil imports the compression modules.
+        import shutil
+
+        # pylint: enable=import-outside-toplevel
+
+        with open(source, "rb") as source_obj, atomic_open(
+            destination, "wb"
+        ) as destination_obj:
+            shutil.copyfileobj(source_obj, destination_obj)
+        os.chmod(destination, 0o644)
+
+    def blobs(self) -> List[str]:
+        """Gets paths of every blob in the store."""
+
+        return [
+            os.path.join(self.root, prefix, name)
+            for prefix in sorted(os.listdir(self.root))
+            if os.path.isdir(os.path.join(self.root, prefix))
+            for name in sorted(os.listdir(os.path.join(self.root, prefix)))
+            if _sha1_match.match(name)
+        ]
+
+    def collect_garbage(self) -> List[str]:
+        """Returns a list of sha1 sums of blobs removed to bring the store under max_bytes."""
+
+        removed: List[str] = []
+        if self.max_bytes is None:
+            return removed
+
+        stats = []
+        for blob_path in self.blobs():
+            with contextlib.suppress(FileNotFoundError):
+                stats.append((blob_path, os.stat(blob_path)))
+
+        total = sum(stat.st_size for _, stat in stats)
+        #  Unreferenced blobs (a single link) go first, then least recently used.
+        stats.sort(key=lambda item: (item[1].st_nlink > 1, item[1].st_mtime))
+
+        for blob_path, stat in stats:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(blob_path)
+                total -= stat.st_size
+                removed.append(os.path.basename(blob_path))
+
+        logging.info(f"Removed blobs from store: {removed}")
+        return removed
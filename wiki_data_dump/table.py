@@ -0,0 +1,180 @@
+"""Holds a columnar table of every file in an index, for bulk filtering and size
+aggregation without building a Wiki, Job and File for each row.
+
+Requires numpy, which is installed with the 'table' extra:
+`pip install wiki_data_dump[table]`"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+COLUMNS = ("wiki", "job", "status")
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+            "FileTable requires numpy, install it with `pip install wiki_data_dump[table]`."
+        )
+
+
+class FileTable:  # pylint: disable=too-many-instance-attributes
+    """One row per file, with numpy arrays for columns: sizes (int64, 0 where the index
+    lists no size), categorical wiki_ids, job_ids and status_ids (the job's status) that
+    index into the wikis, jobs and statuses lists, and names (unicode strings).
+
+    Filters build boolean masks with mask, which every aggregate accepts."""
+
+    wikis: List[str]
+    jobs: List[str]
+    statuses: List[str]
+
+    def __init__(
+        self,
+        wikis: List[str],
+        jobs: List[str],
+        statuses: List[str],
+        wiki_ids,
+        job_ids,
+        status_ids,
+        sizes,
+        names,
+    ):
+        _require_numpy()
+        self.wikis = wikis
+        self.jobs = jobs
+        self.statuses = statuses
+        self.wiki_ids = wiki_ids
+        self.job_ids = job_ids
+        self.status_ids = status_ids
+        self.sizes = sizes
+        self.names = names
+
+    @classmethod
+    def from_index(cls, index: dict) -> "FileTable":
+        """Builds a table from a parsed index.json, reading the raw json directly."""
+
+        _require_numpy()
+
+        categories: Dict[str, Dict[str, int]] = {column: {} for column in COLUMNS}
+        columns: Dict[str, list] = {column: [] for column in COLUMNS}
+        sizes: List[int] = []
+        names: List[str] = []
+
+        def category(column: str, value: str) -> int:
+            return categories[column].setdefault(value, len(categories[column]))
+
+        for wiki_name, wiki in index["wikis"].items():
+            if not wiki:
+                continue
+            wiki_id = category("wiki", wiki_name)
+            for job_name, job in wiki["jobs"].items():
+                files = job.get("files")
+                if not files:
+                    continue
+                job_id = category("job", job_name)
+                status_id = category("status", job.get("status", ""))
+                for file_name, file in files.items():
+                    if not file:
+                        continue
+                    columns["wiki"].append(wiki_id)
+                    columns["job"].append(job_id)
+                    columns["status"].append(status_id)
+                    sizes.append(file.get("size") or 0)
+                    names.append(file_name)
+
+        return cls(
+            wikis=list(categories["wiki"]),
+            jobs=list(categories["job"]),
+            statuses=list(categories["status"]),
+            wiki_ids=np.array(columns["wiki"], dtype=np.int32),
+            job_ids=np.array(columns["job"], dtype=np.int32),
+            status_ids=np.array(columns["status"], dtype=np.int16),
+            sizes=np.array(sizes, dtype=np.int64),
+            names=np.array(names, dtype=np.str_),
+        )
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def _ids(self, column: str):
+        return {
+            "wiki": (self.wiki_ids, self.wikis),
+            "job": (self.job_ids, self.jobs),
+            "status": (self.status_ids, self.statuses),
+        }[column]
+
+    def mask(
+        self,
+        wiki: Optional[str] = None,
+        job: Optional[str] = None,
+        status: Optional[str] = None,
+        name_contains: Optional[str] = None,
+        name_pattern: Optional[re.Pattern] = None,
+    ):
+        """Gets a boolean mask of rows that match every supplied filter. Exact filters and
+        name_contains run vectorized, name_pattern is searched row by row."""
+
+        result = np.ones(len(self), dtype=bool)
+
+        for column, value in (("wiki", wiki), ("job", job), ("status", status)):
+            if value is None:
+                continue
+            ids, values = self._ids(column)
+            if value not in values:
+                return np.zeros(len(self), dtype=bool)
+            result &= ids == values.index(value)
+
+        if name_contains is not None:
+            result &= np.char.find(self.names, name_contains) >= 0
+
+        if name_pattern is not None:
+            result &= np.fromiter(
+                (bool(name_pattern.search(name)) for name in self.names),
+                dtype=bool,
+                count=len(self),
+            )
+
+        return result
+
+    def total_size(self, mask=None) -> int:
+        """Total bytes of rows in mask, or of every row."""
+
+        return int(self.sizes.sum() if mask is None else self.sizes[mask].sum())
+
+    def sum_by(self, column: str, mask=None) -> Dict[str, int]:
+        """Total bytes of rows in mask (or every row) grouped by 'wiki', 'job' or 'status'.
+        Groups without rows are left out."""
+
+        ids, values = self._ids(column)
+        sizes = self.sizes
+        if mask is not None:
+            ids, sizes = ids[mask], sizes[mask]
+        totals = np.bincount(ids, weights=sizes, minlength=len(values))
+        counts = np.bincount(ids, minlength=len(values))
+        return {values[i]: int(totals[i]) for i in np.flatnonzero(counts).tolist()}
+
+    def top_k(self, k: int, mask=None) -> List[Tuple[str, str, str, int]]:
+        """Gets the k largest rows in mask (or of every row), largest first, as
+        (wiki_name, job_name, file_name, size)."""
+
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        if k < len(rows):
+            rows = rows[np.argpartition(-self.sizes[rows], k)[:k]]
+        rows = rows[np.argsort(-self.sizes[rows], kind="stable")]
+        return [self.row(i) for i in rows.tolist()]
+
+    def row(self, i: int) -> Tuple[str, str, str, int]:
+        """Gets row i as (wiki_name, job_name, file_name, size)."""
+
+        return (
+            self.wikis[self.wiki_ids[i]],
+            self.jobs[self.job_ids[i]],
+            str(self.names[i]),
+            int(self.sizes[i]),
+        )
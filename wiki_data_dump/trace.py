@@ -0,0 +1,168 @@
+"""Holds opt-in tracing of index fetches, cache I/O, downloads and decompression, for
+finding which stage (network, sha1, disk writes or decompression) made a transfer slow.
+
+Tracing is off until enable_tracing is called, and while off, span returns a shared span
+that does nothing. Recorded spans are exported with export_chrome_trace, which writes the
+Chrome trace event format read by Perfetto (https://ui.perfetto.dev) and chrome://tracing.
+
+    tracer = enable_tracing()
+    wiki.download(file).join()
+    export_chrome_trace("download.trace.json")
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from wiki_data_dump.locking import atomic_open
+
+clock = time.perf_counter
+
+
+class Tracer:
+    """Collects finished spans as Chrome trace complete ('X') events."""
+
+    def __init__(self):
+        self.started_at = clock()
+        self.events: List[Dict[str, Any]] = []
+        self.thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self, name: str, category: str, start: float, end: float, args: Dict[str, Any]
+    ) -> None:
+        """Records a span that ran from start to end (clock seconds) on this thread."""
+
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self.started_at) * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def to_json(self) -> dict:
+        """Gets the trace as a Chrome trace event format object."""
+
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in thread_names.items()
+        ]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+
+class Span:
+    """A timed stage, recorded by its tracer when the with block exits.
+
+    Time spent on parts of a stage that repeat (such as each chunk of a download) is
+    summed into args with lap, instead of recording a span per repetition."""
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self._start = self._last = 0.0
+
+    def lap(self, key: Optional[str] = None) -> None:
+        """Adds seconds since the last lap (or the start) to args[key], or only restarts
+        the lap if key is None."""
+
+        now = clock()
+        if key is not None:
+            self.args[key] = self.args.get(key, 0.0) + now - self._last
+        self._last = now
+
+    def set(self, **args) -> None:
+        """Adds args to the span."""
+
+        self.args.update(args)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __enter__(self) -> "Span":
+        self._start = self._last = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is not None:
+            self.args["error"] = repr(exc_val)
+        self.tracer.record(self.name, self.category, self._start, clock(), self.args)
+
+
+class _NullSpan:
+    """Returned by span while tracing is off, every method does nothing."""
+
+    def lap(self, key: Optional[str] = None) -> None:
+        """Does nothing."""
+
+    def set(self, **args) -> None:
+        """Does nothing."""
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_tracer: Optional[Tracer] = None  # pylint: disable=invalid-name
+
+
+def enable_tracing() -> Tracer:
+    """Starts recording spans to a new Tracer, which is returned."""
+
+    global _tracer  # pylint: disable=global-statement,invalid-name
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing() -> Optional[Tracer]:
+    """Stops recording spans, returns the Tracer that was recording them, if any."""
+
+    global _tracer  # pylint: disable=global-statement,invalid-name
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def span(name: str, category: str, **args):
+    """Gets a span to time a stage with, which does nothing while tracing is off."""
+
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, category, args)
+
+
+def export_chrome_trace(path: str, tracer: Optional[Tracer] = None) -> None:
+    """Writes spans of tracer (or of the current tracer) to path as a Chrome trace."""
+
+    tracer = tracer if tracer is not None else _tracer
+    assert tracer is not None, "Tracing is not enabled."
+
+    with atomic_open(path, "w", encoding="utf8") as f_buffer:
+        json.dump(tracer.to_json(), f_buffer)
@@ -0,0 +1,220 @@
+"""Holds a watcher that follows job progress through the small per-run dumpstatus.json
+files, instead of re-fetching the full index."""
+
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import wiki_data_dump.api_response
+
+WatchCallbackType = Callable[[str, str, wiki_data_dump.api_response.Job], None]
+
+STATUS_FILE = "dumpstatus.json"
+
+
+def is_final(job: wiki_data_dump.api_response.Job) -> bool:
+    """Whether a job is done and every one of its files has its final sha1 sum."""
+
+    return job.status == "done" and all(
+        file.sha1 for file in (job.files or {}).values()
+    )
+
+
+@dataclass
+class _Watch:
+    """A watched job, with what to do once it is final."""
+
+    callback: Optional[WatchCallbackType]
+    download_dir: Optional[str]
+    fired: bool = False
+
+
+class DumpWatcher:  # pylint: disable=too-many-instance-attributes
+    """Polls dumpstatus.json for each watched wiki's current run, and fires a job's
+    callbacks (or starts downloading its files) once the job becomes final.
+
+    Each poll makes one conditional request per watched wiki, which the mirror answers
+    with an empty 304 response unless the status changed, so tracking hundreds of wikis
+    stays cheap."""
+
+    def __init__(self, wiki_dump, interval: float = 60.0, max_workers: int = 8):
+        self.wiki_dump = wiki_dump
+        self.interval = interval
+        self.max_workers = max_workers
+        self.downloads: List[threading.Thread] = []
+        self._watches: Dict[Tuple[str, str], List[_Watch]] = {}
+        self._status_urls: Dict[str, str] = {}
+        self._validators: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def status_url(self, wiki_name: str) -> str:
+        """Gets the dumpstatus.json url for the run of wiki_name listed in the index,
+        found next to the run's files."""
+
+        try:
+            return self._status_urls[wiki_name]
+        except KeyError:
+            pass
+
+        wiki = self.wiki_dump.get_wiki(wiki_name, cache=False)
+        file_url = next(
+            (
+                file.url
+                for job in wiki.jobs.values()
+                for file in (job.files or {}).values()
+                if file.url
+            ),
+            None,
+        )
+        if file_url is None:
+            raise KeyError(f"{wiki_name} lists no files to locate its run from.")
+
+        run_location = urllib.parse.urljoin(
+            self.wiki_dump.mirror.index_location, file_url
+        )
+        url = urllib.parse.urljoin(run_location, STATUS_FILE)
+        self._status_urls[wiki_name] = url
+        return url
+
+    def watch(
+        self,
+        wiki_name: str,
+        job_name: str,
+        callback: Optional[WatchCallbackType] = None,
+        download_dir: Optional[str] = None,
+    ) -> None:
+        """Watches a job. Once it is final, callback is called with (wiki_name, job_name,
+        Job), and if download_dir is given, the job's files are downloaded to it."""
+
+        url = self.status_url(wiki_name)  # Fail early for wikis that cannot be watched.
+        with self._lock:
+            #  Without validators, the next poll gets the full status even if it has not
+            #  changed, so a job that is already final fires for this watch too.
+            self._validators.pop(url, None)
+            self._watches.setdefault((wiki_name, job_name), []).append(
+                _Watch(callback, download_dir)
+            )
+
+    def _fetch_status(
+        self, wiki_name: str
+    ) -> Optional[wiki_data_dump.api_response.Wiki]:
+        """Conditionally fetches a wiki's run status, None if it has not changed."""
+
+        url = self.status_url(wiki_name)
+        validators = self._validators.get(url, {})
+        headers = {}
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+        response = self.wiki_dump.session.get(url, headers=headers, timeout=10.0)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        self._validators[url] = {
+            key: response.headers[key]
+            for key in ("ETag", "Last-Modified")
+            if key in response.headers
+        }
+        content = json.loads(response.content)
+        return wiki_data_dump.api_response.Wiki(
+            jobs=content.get("jobs", {}), version=content.get("version", "")
+        )
+
+    def poll(self) -> List[Tuple[str, str]]:
+        """Polls every watched wiki once, firing watches of jobs that became final.
+        Returns the (wiki_name, job_name) pairs that fired."""
+
+        with self._lock:
+            wiki_names = sorted(
+                {
+                    wiki_name
+                    for (wiki_name, _), watches in self._watches.items()
+                    if not all(watch.fired for watch in watches)
+                }
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {
+                executor.submit(self._fetch_status, name): name for name in wiki_names
+            }
+            statuses = {}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    statuses[futures[future]] = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    logging.warning(f"Polling {futures[future]} failed: {exc}")
+
+        fired = []
+        for wiki_name, status in sorted(statuses.items()):
+            if status is None:
+                continue
+            for job_name, job in status.jobs.items():
+                if not is_final(job) or not self._fire(wiki_name, job_name, job):
+                    continue
+                fired.append((wiki_name, job_name))
+        return fired
+
+    def _fire(
+        self, wiki_name: str, job_name: str, job: wiki_data_dump.api_response.Job
+    ) -> bool:
+        """Fires watches of a final job that have not fired, returns whether any fired."""
+
+        with self._lock:
+            watches = [
+                watch
+                for watch in self._watches.get((wiki_name, job_name), [])
+                if not watch.fired
+            ]
+            for watch in watches:
+                watch.fired = True
+
+        for watch in watches:
+            if watch.download_dir is not None:
+                os.makedirs(watch.download_dir, exist_ok=True)
+                for file_name, file in (job.files or {}).items():
+                    self.downloads.append(
+                        self.wiki_dump.download(
+                            file, os.path.join(watch.download_dir, file_name), False
+                        )
+                    )
+            if watch.callback is not None:
+                watch.callback(wiki_name, job_name, job)
+        return bool(watches)
+
+    def start(self) -> threading.Thread:
+        """Polls every interval seconds on a background thread until stop is called,
+        or every watch has fired."""
+
+        def run():
+            while not self._stop.is_set():
+                self.poll()
+                with self._lock:
+                    if all(
+                        watch.fired
+                        for watches in self._watches.values()
+                        for watch in watches
+                    ):
+                        return
+                self._stop.wait(self.interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        """Stops background polling started with start."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()